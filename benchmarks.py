@@ -0,0 +1,277 @@
+"""
+Micro-benchmarks.
+
+Usage: python benchmarks.py [benchmark name ...]
+Runs every benchmark if no names are given.
+"""
+
+import sys
+import time
+
+import copy
+import random
+
+from blockstack_zones import parse_zone_file, make_zone_file
+from blockstack_zones.reverse import make_reverse_zone_file
+from blockstack_zones.record_processors import process_a, process_aaaa, process_txt
+from blockstack_zones.names import SymbolTable
+from blockstack_zones.parse_zone_file import make_parser, parse_record, iter_record_tokens
+
+SMALL_ZONE = """$ORIGIN example.com
+$TTL 86400
+@ 10800 IN A 217.70.184.38
+blog 10800 IN CNAME blogs.vip.gandi.net.
+imap 10800 IN CNAME access.mail.gandi.net.
+pop 10800 IN CNAME access.mail.gandi.net.
+smtp 10800 IN CNAME relay.mail.gandi.net.
+webmail 10800 IN CNAME webmail.gandi.net.
+www 10800 IN CNAME webredir.vip.gandi.net.
+@ 10800 IN MX 50 fb.mail.gandi.net.
+@ 10800 IN MX 10 spool.mail.gandi.net.
+"""
+
+
+def timed(func, count):
+    """
+    Run func() @count times, and return the seconds per call
+    """
+    start = time.time()
+    for i in xrange(0, count):
+        func()
+
+    return (time.time() - start) / count
+
+
+def report(name, seconds, baseline=None):
+    line = "%-40s %10.1f us" % (name, seconds * 1e6)
+    if baseline is not None:
+        line += "   (%.1fx)" % (baseline / seconds)
+
+    print line
+
+
+def bench_small_zones():
+    """
+    Parse a 10-record zone, rebuilding the parser on every
+    call (the old behavior) vs. using the shared parser.
+    """
+    from collections import defaultdict
+
+    def parse_rebuilding_parser():
+        parser = make_parser()
+        records = defaultdict(list)
+        for tokens in iter_record_tokens(SMALL_ZONE.split("\n")):
+            record_type, record_dict = parse_record(parser, tokens)
+            records[record_type.lower()].append(record_dict)
+
+        return records
+
+    count = 2000
+    old = timed(parse_rebuilding_parser, count)
+    new = timed(lambda: parse_zone_file(SMALL_ZONE), count)
+
+    report("10 records, make_parser() per call", old)
+    report("10 records, shared parser", new, old)
+
+
+def legacy_process_rr(data, record_type, record_keys, field, template):
+    """
+    process_rr() as it was before serializers were precompiled
+    """
+    if type(record_keys) == str:
+        record_keys = [record_keys]
+
+    record = ""
+    for i in xrange(0, len(data)):
+
+        for record_key in record_keys:
+            assert record_key in data[i].keys(), "Missing '%s'" % record_key
+
+        record_data = []
+        record_data.append( str(data[i].get('name', '@')) )
+        if data[i].get('ttl') is not None:
+            record_data.append( str(data[i]['ttl']) )
+
+        record_data.append(record_type)
+        record_data += [str(data[i][record_key]) for record_key in record_keys]
+        record += " ".join(record_data) + "\n"
+
+    return template.replace(field, record)
+
+
+def legacy_process_txt(data, template):
+    data_dup = copy.deepcopy(data)
+    for i in xrange(0, len(data_dup)):
+        data_dup[i]['txt'] = '"%s"' % data_dup[i]['txt']
+        data_dup[i]['txt'] = data_dup[i]['txt'].replace(";", "\;")
+
+    return legacy_process_rr(data_dup, "TXT", "txt", "{txt}", template)
+
+
+def bench_serializers():
+    """
+    Serialize a million A, AAAA and TXT records each
+    """
+    count = 1000000
+    a = [{'name': 'host%d' % i, 'ip': '10.%d.%d.%d' % (i >> 16, (i >> 8) & 0xff, i & 0xff)}
+         for i in xrange(0, count)]
+    aaaa = [{'name': 'host%d' % i, 'ttl': 300, 'ip': '2001:db8::%x' % i} for i in xrange(0, count)]
+    txt = [{'name': 'host%d' % i, 'txt': 'v=spf1 a mx; id=%d' % i} for i in xrange(0, count)]
+
+    cases = [
+        ("A", a, lambda d: legacy_process_rr(d, "A", "ip", "{a}", "{a}"), lambda d: process_a(d, "{a}")),
+        ("AAAA", aaaa, lambda d: legacy_process_rr(d, "AAAA", "ip", "{aaaa}", "{aaaa}"),
+            lambda d: process_aaaa(d, "{aaaa}")),
+        ("TXT", txt, lambda d: legacy_process_txt(d, "{txt}"), lambda d: process_txt(d, "{txt}")),
+    ]
+
+    for (name, data, old_func, new_func) in cases:
+        assert old_func(data) == new_func(data)
+        old = timed(lambda: old_func(data), 1)
+        new = timed(lambda: new_func(data), 1)
+
+        report("1M %s records, per-record loop" % name, old / count)
+        report("1M %s records, precompiled" % name, new / count, old / count)
+
+
+def deep_size(obj, seen=None):
+    """
+    Total size of @obj and of everything it refers to, counting
+    each object once
+    """
+    if seen is None:
+        seen = set()
+
+    if id(obj) in seen:
+        return 0
+
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for (k, v) in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_size(v, seen) for v in obj)
+
+    return size
+
+
+def scaled_reverse_zone(num_origins, ipv6=False):
+    """
+    A reverse zone fixture, scaled up to @num_origins origins
+    of 254 PTRs each
+    """
+    fixture = "tests/zonefile_reverse_ipv6.txt" if ipv6 else "tests/zonefile_reverse.txt"
+    with open(fixture) as f:
+        header = f.read().split("\n\n")[0:2]
+
+    lines = ["\n\n".join(header)]
+    for i in xrange(0, num_origins):
+        if ipv6:
+            lines.append("$ORIGIN %s.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.8.b.d.0.1.0.0.2.ip6.arpa." %
+                         ".".join("%x" % ((i >> (4 * n)) & 0xf) for n in xrange(0, 4)))
+        else:
+            lines.append("$ORIGIN %d.%d.10.IN-ADDR.ARPA." % (i & 0xff, i >> 8))
+
+        for j in xrange(1, 255):
+            if ipv6:
+                name = "%x.%x" % (j & 0xf, j >> 4)
+            else:
+                name = "%d" % j
+
+            lines.append("%s\tPTR\tHOST%d.MYDOMAIN.COM." % (name, j % 5 + 1))
+
+    return "\n".join(lines) + "\n"
+
+
+def bench_interning():
+    """
+    Memory used by parsed reverse zones of about 50,000 PTRs,
+    without and with name interning
+    """
+    for (name, ipv6) in [("in-addr.arpa", False), ("ip6.arpa", True)]:
+        print "%s:" % name
+        text = scaled_reverse_zone(200, ipv6=ipv6)
+
+        plain = deep_size(parse_zone_file(text, intern_names=False))
+        report_size("not interned", plain)
+
+        symbols = SymbolTable()
+        interned = deep_size(parse_zone_file(text, symbols=symbols))
+        report_size("interned", interned, plain)
+        report_size("  (saved by symbol table)", symbols.bytes_saved)
+
+        refs = deep_size(parse_zone_file(text, ptr_refs=True))
+        report_size("interned, PTR fullname as (label, origin)", refs, plain)
+
+
+def report_size(name, size, baseline=None):
+    line = "%-45s %10.1f MB" % (name, size / 1e6)
+    if baseline is not None:
+        line += "   (%.0f%% saved)" % (100.0 * (baseline - size) / baseline)
+
+    print line
+
+
+class LineCounter(object):
+    """
+    Output stream that only counts the lines written to it
+    """
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, text):
+        self.lines += text.count("\n")
+
+
+def bench_reverse_zones():
+    """
+    PTR records per second for reverse zones of an IPv4 /16 and of an
+    IPv6 /112, and of a sample of 100,000 addresses in an IPv6 /48
+    """
+    pattern = "host-{dashed}.example.com."
+
+    def make_with_dicts():
+        records = [{'name': '%d.%d' % (i & 0xff, i >> 8), 'host': 'host-10-1-%d-%d.example.com.' %
+                    (i >> 8, i & 0xff)} for i in xrange(0, 65536)]
+        return make_zone_file({'$origin': '1.10.in-addr.arpa.', 'ptr': records})
+
+    def generate(cidrs, hostnames):
+        out = LineCounter()
+        start = time.time()
+        make_reverse_zone_file(cidrs, hostnames, output=out)
+        return out.lines / (time.time() - start)
+
+    old = 65536 / timed(make_with_dicts, 1)
+    report_rate("IPv4 /16, dicts + make_zone_file()", old)
+    report_rate("IPv4 /16", generate(["10.1.0.0/16"], pattern), old)
+    report_rate("IPv6 /112", generate(["2001:db8::/112"], pattern))
+
+    rand = random.Random(1)
+    sample = dict(("2001:db8:0:%x:%x:%x:%x:%x" % tuple(rand.randrange(0, 65536) for j in xrange(0, 5)),
+                   "host%d.example.com." % i) for i in xrange(0, 100000))
+    report_rate("IPv6 /48, 100,000 address sample", generate(["2001:db8::/48"], sample))
+
+
+def report_rate(name, rate, baseline=None):
+    line = "%-40s %10.2f M PTR/s" % (name, rate / 1e6)
+    if baseline is not None:
+        line += "   (%.1fx)" % (rate / baseline)
+
+    print line
+
+
+BENCHMARKS = [
+    ('small_zones', bench_small_zones),
+    ('serializers', bench_serializers),
+    ('interning', bench_interning),
+    ('reverse_zones', bench_reverse_zones),
+]
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:]
+    for (name, bench) in BENCHMARKS:
+        if len(names) == 0 or name in names:
+            print "%s:" % name
+            bench()
+            print ""
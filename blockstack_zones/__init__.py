@@ -1,3 +1,3 @@
-from parse_zone_file import parse_zone_file
-from make_zone_file import make_zone_file
-from exceptions import InvalidLineException
+from parse_zone_file import parse_zone_file, iter_zone_file, ParseLimits
+from make_zone_file import make_zone_file, iter_zone_file_lines
+from exceptions import InvalidLineException, ParseLimitException
@@ -0,0 +1,397 @@
+"""
+Batch conversion of many zone files in a single interpreter.
+
+Each input is either a JSON zone file description (converted to a
+zone file) or a zone file (converted to JSON), detected per file.
+Conversions can be spread across several worker processes, and
+`serve` keeps a converter running on a pipe so that the interpreter
+startup cost is only paid once.
+
+In NDJSON mode, zone files are converted to one JSON record per line
+(and back) as they are read, in constant memory.
+"""
+
+import os
+import re
+import sys
+import json
+import itertools
+import traceback
+import multiprocessing
+from StringIO import StringIO
+
+from .parse_zone_file import parse_zone_file, iter_zone_file
+from .make_zone_file import make_zone_file, iter_zone_file_lines
+from .exceptions import InvalidLineException
+
+OUTPUT_EXTENSIONS = {
+    'json': '.json',
+    'ndjson': '.ndjson',
+    'zonefile': '.txt',
+}
+
+
+JSON_START_PATTERN = re.compile(r"\s*\{")
+
+
+def convert_zone_data(dat, origin=None, ttl=None, source="<input>"):
+    """
+    Convert a JSON zone file description into a zone file, or a
+    zone file into its JSON description.  Text that starts with '{'
+    (after any whitespace) is taken to be JSON.
+
+    Return (output text, output type), where the output type is
+    either 'json' or 'zonefile'.
+    Raise ValueError if the JSON is invalid.
+    """
+    if JSON_START_PATTERN.match(dat):
+        json_zone_file = json.loads(dat)
+        return make_zone_file(json_zone_file, origin=origin, ttl=ttl), 'zonefile'
+
+    try:
+        zfj = parse_zone_file(dat)
+    except InvalidLineException, e:
+        print >> sys.stderr, "WARN: %s: Invalid line: %s" % (source, str(e))
+        print >> sys.stderr, "Trying again, while ignoring invalid lines"
+        zfj = parse_zone_file(dat, ignore_invalid=True)
+
+    return json.dumps(zfj, indent=4, sort_keys=True) + "\n", 'json'
+
+
+def sniff_ndjson(instream):
+    """
+    Skip any leading blank lines in @instream, and check whether it holds
+    one JSON record per line (as opposed to a zone file).
+    Return (True if NDJSON, iterator over the remaining lines).
+    """
+    first = ''
+    for first in iter(instream.readline, ''):
+        if len(first.strip()) > 0:
+            break
+
+    lines = itertools.chain([first], iter(instream.readline, ''))
+    return JSON_START_PATTERN.match(first) is not None, lines
+
+
+def sniff_output_type(path, ndjson=False):
+    """
+    Get the type of output that converting the file at @path
+    (in NDJSON mode, if @ndjson is set) makes, without converting it:
+    'zonefile' for JSON input, and 'json' (or 'ndjson') otherwise.
+    Raise IOError if it cannot be read.
+    """
+    with open(path, "r") as f:
+        is_json, lines = sniff_ndjson(f)
+
+    if is_json:
+        return 'zonefile'
+
+    return 'ndjson' if ndjson else 'json'
+
+
+def convert_ndjson_lines(lines, is_ndjson, outstream, origin=None, ttl=None, source="<input>"):
+    """
+    Streaming conversion of @lines to @outstream, one record at a time:
+    * NDJSON records (see iter_zone_file) are written as a zone file
+    * a zone file is written as NDJSON records.  Invalid lines are
+      skipped, with a warning.
+
+    Return the output type, 'zonefile' or 'ndjson'.
+    """
+    if is_ndjson:
+        records = (json.loads(line) for line in lines if len(line.strip()) > 0)
+        for line in iter_zone_file_lines(records, origin=origin, ttl=ttl):
+            outstream.write(line)
+
+        return 'zonefile'
+
+    errors = []
+    warned = 0
+    for record in iter_zone_file(lines, ignore_invalid=True, errors=errors):
+        outstream.write(json.dumps(record, sort_keys=True) + "\n")
+        warned = _warn_invalid(source, errors, warned)
+
+    _warn_invalid(source, errors, warned)
+    return 'ndjson'
+
+
+def _warn_invalid(source, errors, start):
+    """
+    Warn about the skipped invalid lines in errors[@start:].
+    Return the number of errors warned about so far.
+    """
+    for e in errors[start:]:
+        print >> sys.stderr, "WARN: %s: Invalid line: %s" % (source, str(e))
+        print >> sys.stderr, "Skipping it"
+
+    return len(errors)
+
+
+def output_path(name, output_dir, output_type):
+    """
+    Get the path in @output_dir to write the converted form of the
+    input file named @name (relative to the directory it was found in,
+    see iter_input_files) to
+    """
+    stem = os.path.splitext(name)[0]
+    return os.path.join(output_dir, stem + OUTPUT_EXTENSIONS[output_type])
+
+
+def open_output(path):
+    """
+    Open an output file for writing, creating its directory if needed
+    """
+    dirname = os.path.dirname(path)
+    if len(dirname) > 0 and not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # another worker may have made it
+            if not os.path.isdir(dirname):
+                raise
+
+    return open(path, "w")
+
+
+def convert_file(path, output_dir=None, origin=None, ttl=None, ndjson=False, name=None):
+    """
+    Convert the file at @path (in NDJSON mode, if @ndjson is set).
+    If @output_dir is given, write the result there, under @name
+    (by default, the file's base name; see output_path()); otherwise
+    return it in the result's 'data' field.
+
+    Return a dict describing the conversion:
+    {
+        "path":   input path,
+        "type":   'json', 'ndjson' or 'zonefile' (absent on error),
+        "output": output path (if @output_dir was given),
+        "data":   output text (if @output_dir was not given),
+        "error":  traceback text (on error only)
+    }
+    """
+    if name is None:
+        name = os.path.basename(path)
+
+    result = {'path': path}
+    try:
+        if ndjson:
+            with open(path, "r") as f:
+                is_ndjson, lines = sniff_ndjson(f)
+                output_type = 'zonefile' if is_ndjson else 'ndjson'
+                result['type'] = output_type
+
+                if output_dir is not None:
+                    result['output'] = output_path(name, output_dir, output_type)
+                    with open_output(result['output']) as outf:
+                        convert_ndjson_lines(lines, is_ndjson, outf, origin=origin, ttl=ttl,
+                                             source=path)
+                else:
+                    outf = StringIO()
+                    convert_ndjson_lines(lines, is_ndjson, outf, origin=origin, ttl=ttl,
+                                         source=path)
+                    result['data'] = outf.getvalue()
+
+            return result
+
+        with open(path, "r") as f:
+            dat = f.read()
+
+        out, output_type = convert_zone_data(dat, origin=origin, ttl=ttl, source=path)
+        result['type'] = output_type
+
+        if output_dir is not None:
+            result['output'] = output_path(name, output_dir, output_type)
+            with open_output(result['output']) as f:
+                f.write(out)
+        else:
+            result['data'] = out
+
+    except Exception:
+        result['error'] = traceback.format_exc()
+
+    return result
+
+
+def stream_ndjson_file(path, outstream, origin=None, ttl=None):
+    """
+    Convert the file at @path in NDJSON mode, writing the output
+    to @outstream as it is made, rather than buffering it.
+    Return a dict describing the conversion, as convert_file() does
+    (without 'output' or 'data').
+    """
+    result = {'path': path}
+    try:
+        with open(path, "r") as f:
+            is_ndjson, lines = sniff_ndjson(f)
+            result['type'] = 'zonefile' if is_ndjson else 'ndjson'
+            convert_ndjson_lines(lines, is_ndjson, outstream, origin=origin, ttl=ttl,
+                                 source=path)
+
+    except Exception:
+        result['error'] = traceback.format_exc()
+
+    return result
+
+
+def _convert_task(task):
+    """
+    Worker entry point: @task is a (path, output_dir, origin, ttl, ndjson, name)
+    tuple, or an already-made (error) result
+    """
+    if isinstance(task, dict):
+        return task
+
+    return convert_file(*task)
+
+
+def iter_input_files(paths, stdin=None):
+    """
+    Expand the given inputs into a sequence of (file path, name), where
+    name is the path relative to the directory that was given, or the
+    file's base name for files given directly:
+    * a directory expands to the files in it (recursively, sorted)
+    * '-' expands to the newline-delimited list of paths on @stdin
+    * anything else is taken to be a file
+    """
+    if stdin is None:
+        stdin = sys.stdin
+
+    for path in paths:
+        if path == '-':
+            for line in iter(stdin.readline, ''):
+                line = line.strip()
+                if len(line) > 0:
+                    yield line, os.path.basename(line)
+
+        elif os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+                for filename in sorted(filenames):
+                    if not filename.startswith("."):
+                        filepath = os.path.join(dirpath, filename)
+                        yield filepath, os.path.relpath(filepath, path)
+
+        else:
+            yield path, os.path.basename(path)
+
+
+def iter_input_paths(paths, stdin=None):
+    """
+    Expand the given inputs into a sequence of file paths
+    (see iter_input_files)
+    """
+    for (path, name) in iter_input_files(paths, stdin=stdin):
+        yield path
+
+
+def _map_tasks(tasks, jobs):
+    """
+    Run each task through _convert_task, in @jobs processes.
+    Results are generated in task order.
+    """
+    if jobs <= 1:
+        for task in tasks:
+            yield _convert_task(task)
+        return
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap(_convert_task, tasks):
+            yield result
+
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def run_batch(paths, output_dir=None, origin=None, ttl=None, jobs=1, ndjson=False):
+    """
+    Convert every file named by @paths (see iter_input_files).
+    Generate one result per file (see convert_file), in input order.
+
+    Files from a directory are written to the same relative path under
+    @output_dir.  A file whose output would overwrite one of the input
+    files, or the output of an earlier file (e.g. two files with the
+    same name, given directly), is not converted, and gets an error
+    result.
+    """
+    def path_key(path):
+        return os.path.normcase(os.path.realpath(path))
+
+    def tasks():
+        input_files = list(iter_input_files(paths))
+        inputs = set(path_key(path) for (path, name) in input_files)
+        outputs = {}
+
+        for (path, name) in input_files:
+            if output_dir is not None:
+                try:
+                    output_type = sniff_output_type(path, ndjson=ndjson)
+                except (IOError, OSError):
+                    # let the worker report it
+                    output_type = None
+
+                if output_type is not None:
+                    output = output_path(name, output_dir, output_type)
+                    key = path_key(output)
+                    if key in inputs:
+                        yield {'path': path,
+                               'error': "Output for %s would overwrite the input file %s\n" %
+                                        (path, output)}
+                        continue
+
+                    if key in outputs:
+                        yield {'path': path,
+                               'error': "Output for %s would overwrite the output for %s\n" %
+                                        (path, outputs[key])}
+                        continue
+
+                    outputs[key] = path
+
+            yield (path, output_dir, origin, ttl, ndjson, name)
+
+    return _map_tasks(tasks(), jobs)
+
+
+def _parse_request(line, output_dir, origin, ttl, ndjson):
+    """
+    Parse a request line for serve().
+    A request is either a bare path, or a JSON object with a "path" and,
+    optionally, "output_dir", "origin", "ttl" and "ndjson" overrides.
+    """
+    if line.startswith("{"):
+        try:
+            req = json.loads(line)
+            return (req['path'], req.get('output_dir', output_dir),
+                    req.get('origin', origin), req.get('ttl', ttl),
+                    req.get('ndjson', ndjson), None)
+        except (ValueError, KeyError, TypeError):
+            # let the worker report the bad request
+            pass
+
+    return (line, output_dir, origin, ttl, ndjson, None)
+
+
+def serve(instream, outstream, output_dir=None, origin=None, ttl=None, jobs=1, ndjson=False):
+    """
+    Long-running mode: read one request per line from @instream until EOF,
+    and write one JSON-encoded result per line to @outstream (see
+    convert_file), in request order.
+    Each result is flushed as soon as it is ready.
+    """
+    def requests():
+        for line in iter(instream.readline, ''):
+            line = line.strip()
+            if len(line) > 0:
+                yield _parse_request(line, output_dir, origin, ttl, ndjson)
+
+    count = 0
+    for result in _map_tasks(requests(), jobs):
+        outstream.write(json.dumps(result, sort_keys=True) + "\n")
+        outstream.flush()
+        count += 1
+
+    return count
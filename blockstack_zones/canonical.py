@@ -0,0 +1,364 @@
+"""
+Canonical form of a zone file, so that equivalent zones
+serialize to the same text:
+* owner names are made relative to the zone's $ORIGIN, and
+  domain names in record data are made absolute (all lower-case).
+  Zones without an $ORIGIN keep their relative names.
+* records with the same owner, type and data are only kept once
+* all the records of an RRset (same owner and type) get the same TTL,
+  the lowest of their TTLs (RFC 2181, section 5.2), and TTLs equal to
+  the zone's $TTL are left implicit
+* records are sorted in DNSSEC canonical order (RFC 4034, section 6),
+  after the SOA record
+
+Zones larger than the memory budget are sorted on disk.
+"""
+
+import re
+import heapq
+import socket
+import tempfile
+import cPickle
+from StringIO import StringIO
+
+from .configs import RECORD_TYPE_CODES
+from .parse_zone_file import iter_zone_file
+from .make_zone_file import make_record_line
+from .names import absolute_name, record_owner, canonical_name_key
+
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+
+TTL_PATTERN = re.compile(r"^(\d+[wdhms]?)+$", re.IGNORECASE)
+TTL_UNITS = {'w': 604800, 'd': 86400, 'h': 3600, 'm': 60, 's': 1}
+
+# record type: [(rdata field, kind)]
+RDATA_FIELDS = {
+    'soa': [('mname', 'name'), ('rname', 'name'), ('serial', 'int'), ('refresh', 'int'),
+            ('retry', 'int'), ('expire', 'int'), ('minimum', 'int')],
+    'ns': [('host', 'name')],
+    'a': [('ip', 'ipv4')],
+    'aaaa': [('ip', 'ipv6')],
+    'cname': [('alias', 'name')],
+    'mx': [('preference', 'int'), ('host', 'name')],
+    'ptr': [('host', 'name')],
+    'txt': [('txt', 'string')],
+    'srv': [('priority', 'int'), ('weight', 'int'), ('port', 'int'), ('target', 'name')],
+    'spf': [('data', 'string')],
+    'uri': [('priority', 'int'), ('weight', 'int'), ('target', 'raw')],
+}
+
+
+def name_wire_key(name):
+    """
+    Sort key that orders absolute names like their
+    uncompressed wire format does
+    """
+    if len(name) == 0:
+        return ()
+
+    return tuple((len(label), label) for label in name.split('.'))
+
+
+def rdata_field_key(value, kind):
+    """
+    Sort key that orders a normalized rdata field like its wire format does
+    """
+    if kind == 'name':
+        return name_wire_key(value.rstrip('.'))
+
+    elif kind == 'int':
+        try:
+            return int(value)
+        except ValueError:
+            return value
+
+    elif kind in ('ipv4', 'ipv6'):
+        family = socket.AF_INET if kind == 'ipv4' else socket.AF_INET6
+        try:
+            return socket.inet_pton(family, value)
+        except socket.error:
+            return value
+
+    elif kind == 'string':
+        return (len(value), value)
+
+    return value
+
+
+def ttl_seconds(ttl):
+    """
+    Get the number of seconds in a TTL, which is either a number or
+    in BIND's format (e.g. "1h30m").  Return None if it is neither.
+    """
+    ttl = str(ttl)
+    if TTL_PATTERN.match(ttl) is None:
+        return None
+
+    seconds = 0
+    for (value, unit) in re.findall(r"(\d+)([wdhms]?)", ttl.lower()):
+        seconds += int(value) * TTL_UNITS.get(unit, 1)
+
+    return seconds
+
+
+def ttl_key(ttl):
+    """
+    Sort key for TTLs, that orders them by their number of seconds
+    (TTLs that cannot be read sort after all others)
+    """
+    seconds = ttl_seconds(ttl)
+    if seconds is None:
+        return (1, str(ttl))
+
+    return (0, seconds)
+
+
+def is_relative(name):
+    """
+    Is @name relative to the $ORIGIN?
+    """
+    return not str(name).endswith('.')
+
+
+def has_relative_names(record):
+    """
+    Does the parsed record have a relative owner name, or
+    a relative domain name in its data?
+    """
+    if is_relative(record.get('name', '@')):
+        return True
+
+    for (field, kind) in RDATA_FIELDS.get(record['type'], []):
+        if kind == 'name' and field in record and is_relative(record[field]):
+            return True
+
+    return False
+
+
+def relative_name(name, origin):
+    """
+    Make the absolute name @name relative to the absolute name @origin
+    """
+    if origin is None:
+        return name or '@'
+    elif name == origin:
+        return '@'
+    elif name.endswith('.' + origin):
+        return name[:-len(origin) - 1]
+
+    return name + '.'
+
+
+def canonical_entry(record, origin, ttl, zone_origin):
+    """
+    Normalize a parsed record (see iter_zone_file), given the $ORIGIN
+    and $TTL in effect and the zone's own $ORIGIN (as an absolute name).
+    With no $ORIGIN, names are left as they are (in lower-case).
+
+    Return (sort key, TTL key, TTL, record), where the sort key orders
+    records by owner, type and data, and TTL is the record's TTL (None
+    if it has none).  The record has no TTL of its own.
+    """
+    record_type = record['type']
+
+    datum = dict(record)
+    datum.pop('fullname', None)
+    datum.pop('ttl', None)
+
+    if origin is None:
+        datum['name'] = str(record.get('name', '@')).lower()
+        owner = datum['name'].rstrip('.')
+    else:
+        owner = record_owner(record, origin)
+        datum['name'] = relative_name(owner, zone_origin)
+
+    rdata_key = []
+    for (field, kind) in RDATA_FIELDS.get(record_type, []):
+        value = datum.get(field)
+        if value is None:
+            continue
+
+        if kind == 'name':
+            if origin is None:
+                value = str(value).lower()
+            else:
+                value = absolute_name(value, origin) + '.'
+
+            datum[field] = value
+
+        rdata_key.append(rdata_field_key(value, kind))
+
+    record_ttl = record.get('ttl', ttl)
+    sort_key = (canonical_name_key(owner), RECORD_TYPE_CODES[record_type.upper()], tuple(rdata_key))
+    return (sort_key, ttl_key(record_ttl) if record_ttl is not None else None, record_ttl, datum)
+
+
+def entry_size(entry):
+    """
+    Rough estimate of the memory used by a buffered entry
+    """
+    return 2 * sum(len(str(v)) for v in entry[3].values()) + 512
+
+
+def _iter_rrset_lines(entries, zone_ttl):
+    """
+    Given sorted entries, generate the zonefile line of each distinct
+    record, with a single TTL per RRset: the lowest TTL in it
+    """
+    rrset = []
+    for entry in entries:
+        if len(rrset) > 0 and entry[0][0:2] != rrset[0][0][0:2]:
+            for line in _rrset_lines(rrset, zone_ttl):
+                yield line
+
+            rrset = []
+
+        rrset.append(entry)
+
+    for line in _rrset_lines(rrset, zone_ttl):
+        yield line
+
+
+def _rrset_lines(rrset, zone_ttl):
+    """
+    Get the zonefile lines of the records of one RRset (see _iter_rrset_lines)
+    """
+    ttls = [(key, ttl) for (sort_key, key, ttl, datum) in rrset if key is not None]
+    ttl = min(ttls)[1] if len(ttls) > 0 else None
+    if ttl is not None and zone_ttl is not None and ttl_key(ttl) == ttl_key(zone_ttl):
+        ttl = None
+
+    lines = []
+    prev = None
+    for (sort_key, key, record_ttl, datum) in rrset:
+        if sort_key == prev:
+            continue
+
+        prev = sort_key
+        if ttl is not None:
+            datum = dict(datum)
+            datum['ttl'] = ttl
+
+        lines.append(make_record_line(datum))
+
+    return lines
+
+
+def _write_run(entries, tmpdir):
+    """
+    Write a sorted run of entries to a temporary file
+    """
+    f = tempfile.TemporaryFile(dir=tmpdir)
+    pickler = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+    for entry in entries:
+        pickler.dump(entry)
+
+    f.seek(0)
+    return f
+
+
+def _read_run(f):
+    """
+    Generate the entries of a run written by _write_run
+    """
+    unpickler = cPickle.Unpickler(f)
+    try:
+        while True:
+            yield unpickler.load()
+    except EOFError:
+        f.close()
+
+
+def iter_canonical_zone_file(source, memory_budget=DEFAULT_MEMORY_BUDGET, tmpdir=None,
+                             ignore_invalid=False):
+    """
+    Generate the lines of the canonical form of a zonefile (text, or
+    iterable of lines).  Once more than about @memory_budget bytes of
+    records are buffered, they are sorted into runs in @tmpdir and merged.
+    """
+    origin = None
+    ttl = None
+    zone_origin = None
+    zone_ttl = None
+
+    soa_entries = []
+    buf = []
+    buf_size = 0
+    runs = []
+
+    unqualified = None
+
+    for record in iter_zone_file(source, ignore_invalid=ignore_invalid):
+        record_type = record['type']
+        if record_type == '$origin':
+            if unqualified is not None:
+                raise ValueError("Relative name before the first $ORIGIN: %s" %
+                                 make_record_line(unqualified).strip())
+
+            origin = record['value']
+            if zone_origin is None:
+                zone_origin = absolute_name('@', origin)
+
+            continue
+
+        elif record_type == '$ttl':
+            ttl = record['value']
+            if zone_ttl is None:
+                zone_ttl = ttl
+
+            continue
+
+        if origin is None and unqualified is None and has_relative_names(record):
+            unqualified = record
+
+        entry = canonical_entry(record, origin, ttl, zone_origin)
+        if record_type == 'soa':
+            soa_entries.append(entry)
+            continue
+
+        buf.append(entry)
+        buf_size += entry_size(entry)
+
+        if buf_size > memory_budget:
+            buf.sort()
+            runs.append(_write_run(buf, tmpdir))
+            buf = []
+            buf_size = 0
+
+    if zone_origin is not None:
+        yield make_record_line({'type': '$origin', 'value': zone_origin + '.'})
+
+    if zone_ttl is not None:
+        yield make_record_line({'type': '$ttl', 'value': zone_ttl})
+
+    buf.sort()
+    if len(runs) > 0:
+        entries = heapq.merge(_read_run(_write_run(buf, tmpdir)), *[_read_run(f) for f in runs])
+    else:
+        entries = iter(buf)
+
+    soa_entries.sort()
+    for entries in (soa_entries, entries):
+        for line in _iter_rrset_lines(entries, zone_ttl):
+            yield line
+
+
+def canonicalize_zone_file(source, output=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                           tmpdir=None, ignore_invalid=False):
+    """
+    Write the canonical form of a zonefile (text, or iterable of lines).
+    See iter_canonical_zone_file().
+
+    If @output (a file-like object) is given, write the zonefile to it.
+    Otherwise, return the zonefile.
+    """
+    stream = output
+    if stream is None:
+        stream = StringIO()
+
+    for line in iter_canonical_zone_file(source, memory_budget=memory_budget, tmpdir=tmpdir,
+                                         ignore_invalid=ignore_invalid):
+        stream.write(line)
+
+    if output is None:
+        return stream.getvalue()
@@ -1,8 +1,27 @@
 SUPPORTED_RECORDS = [
-    '$ORIGIN', '$TTL', 'SOA', 'NS', 'A', 'AAAA', 'CNAME', 'MX', 'PTR', 'TXT',
+    '$ORIGIN', '$TTL', '$INCLUDE', 'SOA', 'NS', 'A', 'AAAA', 'CNAME', 'MX', 'PTR', 'TXT',
     'SRV', 'SPF', 'URI'
 ]
 
+# see RFC 1035
+RECORD_CLASSES = ['IN', 'CS', 'CH', 'HS']
+
+# record type: fields holding domain names
+NAME_FIELDS = {
+    'soa': ['mname', 'rname'],
+    'ns': ['host'],
+    'cname': ['alias'],
+    'mx': ['host'],
+    'ptr': ['host'],
+    'srv': ['target'],
+}
+
+# see the IANA DNS parameters registry
+RECORD_TYPE_CODES = {
+    'A': 1, 'NS': 2, 'CNAME': 5, 'SOA': 6, 'PTR': 12, 'MX': 15, 'TXT': 16,
+    'AAAA': 28, 'SRV': 33, 'SPF': 99, 'URI': 256
+}
+
 DEFAULT_TEMPLATE = """
 {$origin}\n\
 {$ttl}\n\
@@ -1,2 +1,24 @@
 class InvalidLineException(Exception):
-    pass
\ No newline at end of file
+    """
+    A zonefile record could not be parsed.
+    Where known, the exception has the (1-based) line number and
+    column of the error, the record type that was attempted, the
+    record's text and the name of the file it is in.
+    """
+    def __init__(self, message, lineno=None, column=None, record_type=None, line=None,
+                 filename=None):
+        super(InvalidLineException, self).__init__(message)
+        self.lineno = lineno
+        self.column = column
+        self.record_type = record_type
+        self.line = line
+        self.filename = filename
+
+
+class ParseLimitException(InvalidLineException):
+    """
+    A zonefile exceeded one of the parser's limits (see ParseLimits).
+    Raised even when ignoring invalid lines.
+    """
+    def __init__(self, message, lineno=None):
+        super(ParseLimitException, self).__init__(message, lineno=lineno)
@@ -1,7 +1,7 @@
 from .record_processors import (
     process_origin, process_ttl, process_soa, process_ns, process_a,
     process_aaaa, process_cname, process_mx, process_ptr, process_txt,
-    process_srv, process_spf, process_uri
+    process_srv, process_spf, process_uri, serialize_record
 )
 from .configs import DEFAULT_TEMPLATE
 import copy
@@ -65,3 +65,35 @@ def make_zone_file(json_zone_file_input, origin=None, ttl=None, template=None):
     ) + "\n"
 
     return zone_file
+
+
+def iter_zone_file_lines(records, origin=None, ttl=None):
+    """
+    Generate the DNS zonefile one line at a time, given an iterable
+    of records in the form generated by iter_zone_file():
+        {"type": "a", "name": "www", "ip": "10.0.1.5"}
+        {"type": "$origin", "value": "example.com"}
+
+    Records are written in the order given.  @origin and @ttl, if given,
+    are written before any records.
+    """
+    if origin is not None:
+        yield serialize_record('$origin', origin) + "\n"
+
+    if ttl is not None:
+        yield serialize_record('$ttl', ttl) + "\n"
+
+    for record in records:
+        yield make_record_line(record)
+
+
+def make_record_line(record):
+    """
+    Serialize a single record in the form generated by
+    iter_zone_file() into a zonefile line
+    """
+    record_type = record['type']
+    if record_type.startswith("$"):
+        return serialize_record(record_type, record['value']) + "\n"
+
+    return serialize_record(record_type, record) + "\n"
@@ -0,0 +1,80 @@
+"""
+Helpers for working with domain names in parsed records.
+"""
+
+import sys
+from collections import namedtuple
+
+
+class SymbolTable(object):
+    """
+    Table of interned names, so that every occurrence of a name
+    in a parsed zone shares a single string.
+    """
+    def __init__(self):
+        self._symbols = {}
+        self.bytes_saved = 0
+
+    def intern(self, name):
+        """
+        Get the shared copy of @name
+        """
+        symbol = self._symbols.setdefault(name, name)
+        if symbol is not name:
+            self.bytes_saved += sys.getsizeof(name)
+
+        return symbol
+
+    def __len__(self):
+        return len(self._symbols)
+
+
+class NameRef(namedtuple('NameRef', ['label', 'origin'])):
+    """
+    A name stored as its (label, origin) pair instead of as the
+    concatenated string, so that names under the same origin share it.
+    str() gives the full name.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        if self.label == '@':
+            return self.origin
+        elif self.label.endswith('.'):
+            return self.label
+
+        return self.label + '.' + self.origin
+
+
+def absolute_name(name, origin):
+    """
+    Get the absolute, lower-case form of @name relative to @origin,
+    without the trailing '.'
+    """
+    name = str(name)
+    if name == '@':
+        name = origin or ''
+    elif not name.endswith('.') and origin:
+        name = name + '.' + origin
+
+    return name.rstrip('.').lower()
+
+
+def record_owner(record, origin):
+    """
+    Get the absolute, lower-case owner name of a parsed record,
+    using its own 'origin' (see parse_zone_file) if it has one
+    """
+    return absolute_name(record.get('name', '@'), record.get('origin', origin))
+
+
+def canonical_name_key(name):
+    """
+    Sort key that puts absolute names (as returned by absolute_name)
+    in DNSSEC canonical order (RFC 4034, section 6.1): by label,
+    from the most significant (rightmost) label.
+    """
+    if len(name) == 0:
+        return ()
+
+    return tuple(reversed(name.split('.')))
@@ -2,22 +2,26 @@
 
 """
 Known limitations:
-    * only one $ORIGIN and one $TTL are supported
     * only the IN class is supported
     * PTR records must have a non-empty name
     * currently only supports the following:
-    '$ORIGIN', '$TTL', 'SOA', 'NS', 'A', 'AAAA', 'CNAME', 'MX', 'PTR',
-    'TXT', 'SRV', 'SPF', 'URI'
+    '$ORIGIN', '$TTL', '$INCLUDE', 'SOA', 'NS', 'A', 'AAAA', 'CNAME', 'MX',
+    'PTR', 'TXT', 'SRV', 'SPF', 'URI'
 """
 
+import os
+import re
+import stat
 import copy
 import datetime
 import time
 import argparse
-from collections import defaultdict
+import threading
+from collections import defaultdict, namedtuple, OrderedDict
 
-from .configs import SUPPORTED_RECORDS, DEFAULT_TEMPLATE
-from .exceptions import InvalidLineException
+from .configs import SUPPORTED_RECORDS, RECORD_CLASSES, NAME_FIELDS, DEFAULT_TEMPLATE
+from .exceptions import InvalidLineException, ParseLimitException
+from .names import SymbolTable, NameRef
 
 
 class ZonefileLineParser(argparse.ArgumentParser):
@@ -59,6 +63,11 @@ def make_parser():
     sp = subparsers.add_parser("$TTL")
     sp.add_argument("$TTL", type=int)
 
+    # parse $INCLUDE
+    sp = subparsers.add_parser("$INCLUDE")
+    sp.add_argument("$INCLUDE", type=str)
+    sp.add_argument("origin", type=str, nargs='?')
+
     # parse each RR
     args_and_types = [
         ("mname", str), ("rname", str), ("serial", int), ("refresh", int),
@@ -80,28 +89,52 @@ def make_parser():
     return line_parser
 
 
-def tokenize_line(line):
+_parser = None
+_parser_lock = threading.Lock()
+
+
+def get_parser():
+    """
+    Get the shared ArgumentParser that accepts DNS RRs.
+    It is built on first use.  Parsing a record does not modify
+    it, so it can be used from several threads at once.
+    """
+    global _parser
+    if _parser is None:
+        with _parser_lock:
+            if _parser is None:
+                _parser = make_parser()
+
+    return _parser
+
+
+def tokenize_line(line, spans=None):
     """
     Tokenize a line:
     * split tokens on whitespace
     * treat quoted strings as a single token
     * drop comments
     * handle escaped spaces and comment delimiters
+
+    If @spans is given, append the (0-based) column
+    where each token starts to it.
     """
     ret = []
     escape = False
     quote = False
     tokbuf = ""
-    ll = list(line)
-    while len(ll) > 0:
-        c = ll.pop(0)
+    start = 0
+    for (i, c) in enumerate(line):
         if c.isspace():
             if not quote and not escape:
                 # end of token
                 if len(tokbuf) > 0:
                     ret.append(tokbuf)
+                    if spans is not None:
+                        spans.append(start)
 
                 tokbuf = ""
+                start = i + 1
             elif quote:
                 # in quotes
                 tokbuf += c
@@ -122,7 +155,11 @@ def tokenize_line(line):
                 if quote:
                     # end of quote
                     ret.append(tokbuf)
+                    if spans is not None:
+                        spans.append(start)
+
                     tokbuf = ""
+                    start = i + 1
                     quote = False
                     continue
                 else:
@@ -133,6 +170,9 @@ def tokenize_line(line):
             if not escape:
                 # comment 
                 ret.append(tokbuf)
+                if spans is not None:
+                    spans.append(start)
+
                 tokbuf = ""
                 break
             
@@ -142,6 +182,8 @@ def tokenize_line(line):
 
     if len(tokbuf.strip(" ").strip("\n")) > 0:
         ret.append(tokbuf)
+        if spans is not None:
+            spans.append(start)
 
     return ret
 
@@ -203,8 +245,7 @@ def flatten(text):
     captured = []
 
     flattened = []
-    while len(tokens) > 0:
-        tok = tokens.pop(0)
+    for tok in tokens:
         if not capturing and len(tok) == 0:
             # normal end-of-line
             if len(captured) > 0:
@@ -278,13 +319,14 @@ def add_default_name(text):
     return "\n".join(ret)
 
 
-def parse_line(parser, record_token, parsed_records):
+def parse_record(parser, record_token, current_origin=None):
     """
-    Given the parser, capitalized list of a line's tokens, and the current set of records 
-    parsed so far, parse it into a dictionary.
+    Given the parser and the list of a record's tokens, parse it into
+    a dictionary.  @current_origin is the $ORIGIN in effect, if known.
 
-    Return the new set of parsed records.
-    Raise an exception on error.
+    Return (record type, record dict), where a directive's record
+    dict holds the directive's value under its record type.
+    Raise InvalidLineException on error.
     """
 
     global SUPPORTED_RECORDS
@@ -301,10 +343,18 @@ def parse_line(parser, record_token, parsed_records):
 
     try:
         rr, unmatched = parser.parse_known_args(record_token)
-        assert len(unmatched) == 0, "Unmatched fields: %s" % unmatched
-    except (SystemExit, AssertionError, InvalidLineException):
+    except (SystemExit, InvalidLineException), e:
         # invalid argument 
-        raise InvalidLineException(line)
+        error = InvalidLineException(line, line=line)
+        error.reason = str(e)
+        error.unmatched = None
+        raise error
+
+    if len(unmatched) > 0:
+        error = InvalidLineException(line, line=line)
+        error.reason = "Unmatched fields: %s" % unmatched
+        error.unmatched = unmatched
+        raise error
 
     record_dict = rr.__dict__
 
@@ -317,19 +367,49 @@ def parse_line(parser, record_token, parsed_records):
                 del record_dict[key]
             break
 
-    assert record_type is not None, "Unknown record type in %s" % rr
+    if record_type is None:
+        # the record's data is missing, so its type was taken as data
+        # (e.g. "www 60 A" parses as an A record for "60" at "A")
+        error = InvalidLineException(line, line=line)
+        error.reason = "too few arguments"
+        error.unmatched = None
+        raise error
 
     # clean fields
     for field in record_dict.keys():
         if record_dict[field] is None:
             del record_dict[field]
 
-    current_origin = record_dict.get('$ORIGIN', parsed_records.get('$ORIGIN', None))
-
     # special record-specific fix-ups
-    if record_type == 'PTR':
-        record_dict['fullname'] = record_dict['name'] + '.' + current_origin
-      
+    if record_type == 'PTR' and current_origin is not None:
+        record_dict['fullname'] = ptr_fullname(record_dict['name'], current_origin)
+
+    return record_type, record_dict
+
+
+def ptr_fullname(name, origin):
+    """
+    Get the full name of a PTR record's @name under @origin
+    """
+    if name == '@':
+        return origin
+    elif name.endswith('.'):
+        return name
+
+    return name + '.' + origin
+
+
+def parse_line(parser, record_token, parsed_records):
+    """
+    Given the parser, capitalized list of a line's tokens, and the current set of records 
+    parsed so far, parse it into a dictionary.
+
+    Return the new set of parsed records.
+    Raise an exception on error.
+    """
+    record_type, record_dict = parse_record(
+        parser, record_token, parsed_records.get('$origin', None))
+
     if len(record_dict) > 0:
         if record_type.startswith("$"):
             # put the value directly
@@ -347,10 +427,13 @@ def parse_lines(text, ignore_invalid=False):
     Parse a zonefile into a dict.
     @text must be flattened--each record must be on one line.
     Also, all comments must be removed.
+    This is the line-at-a-time API (see remove_comments, flatten,
+    remove_class and add_default_name), kept for existing callers;
+    parse_zone_file() parses the zonefile text directly.
     """
     json_zone_file = defaultdict(list)
     record_lines = text.split("\n")
-    parser = make_parser()
+    parser = get_parser()
 
     for record_line in record_lines:
         record_token = tokenize_line(record_line)
@@ -365,13 +448,643 @@ def parse_lines(text, ignore_invalid=False):
     return json_zone_file
 
 
-def parse_zone_file(text, ignore_invalid=False):
+def fix_record_tokens(tokens, spans=()):
+    """
+    Given the tokens of one record, remove its CLASS (if present)
+    and make sure it has a name (using '@' if there is none).
+    @spans are lists that run parallel to @tokens, and are kept
+    parallel to the result.
+    """
+    global SUPPORTED_RECORDS
+
+    if tokens[0].startswith("$"):
+        return tokens
+
+    type_index = None
+    for i in xrange(0, min(len(tokens), 4)):
+        if tokens[i] in SUPPORTED_RECORDS:
+            type_index = i
+            break
+
+    class_index = None
+    if type_index is not None:
+        # see RFC 1035 for list of classes.
+        # the class is either right before the type, or
+        # right before the TTL if the TTL follows it.
+        if type_index >= 1 and tokens[type_index - 1].upper() in RECORD_CLASSES:
+            class_index = type_index - 1
+        elif type_index >= 3 and tokens[type_index - 2].upper() in RECORD_CLASSES and \
+                tokens[type_index - 1].isdigit():
+            class_index = type_index - 2
+
+    if class_index is not None:
+        del tokens[class_index]
+        for span in spans:
+            del span[class_index]
+
+    if tokens[0] in SUPPORTED_RECORDS:
+        # add back the name
+        tokens = ['@'] + tokens
+        for span in spans:
+            span.insert(0, span[0])
+
+    return tokens
+
+
+class ParseLimits(namedtuple('ParseLimits', ['max_record_length', 'max_tokens', 'max_records', 'max_bytes'])):
+    """
+    Limits on the size of a zonefile, for parsing untrusted input.
+    Each is None for no limit.
+    * max_record_length: characters in a record (or in any one line)
+    * max_tokens: tokens in a record
+    * max_records: records (and directives) in a zonefile
+    * max_bytes: characters in a zonefile
+    The records and characters of $INCLUDE'd files count towards the
+    including zonefile's totals.
+    """
+    def __new__(cls, max_record_length=None, max_tokens=None, max_records=None, max_bytes=None):
+        return super(ParseLimits, cls).__new__(cls, max_record_length, max_tokens, max_records, max_bytes)
+
+
+NO_LIMITS = ParseLimits()
+
+
+class ParseCounts(object):
+    """
+    Running count of the characters and records read from a zonefile
+    (and the files it $INCLUDEs), checked against its ParseLimits
+    """
+    def __init__(self, limits=None):
+        self.limits = limits if limits is not None else NO_LIMITS
+        self.num_bytes = 0
+        self.num_records = 0
+
+    def add(self, num_bytes=0, num_records=0, lineno=None, where=None):
+        """
+        Count @num_bytes characters and @num_records records more.
+        Raise ParseLimitException if the totals exceed the limits,
+        with a message starting with @where (by default, the line number)
+        """
+        self.num_bytes += num_bytes
+        self.num_records += num_records
+
+        limits = self.limits
+        if limits.max_bytes is not None and self.num_bytes > limits.max_bytes:
+            reason = "zonefile exceeds %d bytes" % limits.max_bytes
+        elif limits.max_records is not None and self.num_records > limits.max_records:
+            reason = "zonefile exceeds %d records" % limits.max_records
+        else:
+            return
+
+        if where is None:
+            where = "line %d" % lineno
+
+        raise ParseLimitException("%s: %s" % (where, reason), lineno)
+
+
+def iter_file_lines(f, limits=None):
+    """
+    Generate the lines of the open file @f.
+    If @limits has a max_record_length, read at most that many
+    characters (and a line break) at a time, so that an over-long
+    line is cut short (and rejected by iter_record_spans) instead
+    of being read into memory whole.
+    """
+    size = -1
+    if limits is not None and limits.max_record_length is not None:
+        size = limits.max_record_length + 2
+
+    while True:
+        line = f.readline(size)
+        if len(line) == 0:
+            return
+
+        yield line
+
+
+def iter_record_spans(lines, limits=None, counts=None):
+    """
+    Given an iterable of a zonefile's lines, generate the list of
+    tokens of each record in it, as it is read:
+    * comments are dropped
+    * records grouped across lines with (...) are joined
+    * the CLASS is removed, and a default name is added
+      (see fix_record_tokens)
+
+    Generate (tokens, token line numbers, token columns), where the
+    line numbers and columns (1-based) give where each token starts.
+    Raise InvalidLineException if the input ends inside a (...) group.
+
+    Raise ParseLimitException as soon as the input exceeds
+    one of the @limits (see ParseLimits).  The characters and records
+    read are added to @counts (see ParseCounts), if given, so that
+    several files can share one total.
+    """
+    if limits is None:
+        limits = NO_LIMITS
+
+    if counts is None:
+        counts = ParseCounts(limits)
+
+    capturing = False
+    captured = []
+    captured_lines = []
+    captured_cols = []
+    captured_len = 0
+    record_lineno = 0
+    line_break = 0
+
+    for (lineno, line) in enumerate(lines, 1):
+        # lines without their line break (as from str.split) are
+        # separated by one, counted once the next line is read
+        counts.add(num_bytes=line_break + len(line), lineno=lineno)
+        line_break = 0 if line.endswith("\n") else 1
+
+        if limits.max_record_length is not None and len(line) > limits.max_record_length and \
+                len(line.rstrip("\r\n")) > limits.max_record_length:
+            raise ParseLimitException(
+                "line %d: line exceeds %d characters" % (lineno, limits.max_record_length), lineno)
+
+        if len(captured) == 0:
+            record_lineno = lineno
+
+        cols = []
+        tokens = tokenize_line(line, cols)
+        for i in xrange(0, len(tokens)):
+            tok = tokens[i]
+            col = cols[i]
+            if tok.startswith("("):
+                # begin grouping
+                stripped = tok.lstrip("(")
+                col += len(tok) - len(stripped)
+                tok = stripped
+                capturing = True
+
+            if capturing and tok.endswith(")"):
+                # end grouping.  the end of this line ends the record.
+                tok = tok.rstrip(")")
+                capturing = False
+
+            if len(tok) > 0:
+                captured.append(tok)
+                captured_lines.append(lineno)
+                captured_cols.append(col + 1)
+                captured_len += len(tok) + 1
+
+        if limits.max_tokens is not None and len(captured) > limits.max_tokens:
+            raise ParseLimitException(
+                "line %d: record starting on line %d exceeds %d tokens" %
+                (lineno, record_lineno, limits.max_tokens), record_lineno)
+
+        if limits.max_record_length is not None and captured_len > limits.max_record_length + 1:
+            raise ParseLimitException(
+                "line %d: record starting on line %d exceeds %d characters" %
+                (lineno, record_lineno, limits.max_record_length), record_lineno)
+
+        if not capturing and len(captured) > 0:
+            counts.add(num_records=1, lineno=lineno)
+            captured = fix_record_tokens(captured, (captured_lines, captured_cols))
+            yield captured, captured_lines, captured_cols
+
+            captured = []
+            captured_lines = []
+            captured_cols = []
+            captured_len = 0
+
+    if capturing:
+        # the input ended inside a (...) group
+        line = " ".join(captured)
+        raise InvalidLineException(
+            "line %d: unterminated '(' in record: %s" % (record_lineno, line),
+            lineno=record_lineno, column=captured_cols[0] if len(captured_cols) > 0 else None,
+            record_type=guess_record_type(captured), line=line)
+
+
+def iter_record_tokens(lines, limits=None):
+    """
+    Given an iterable of a zonefile's lines, generate the list of
+    tokens of each record in it, as it is read (see iter_record_spans).
+    """
+    for (tokens, token_lines, token_cols) in iter_record_spans(lines, limits=limits):
+        yield tokens
+
+
+def guess_record_type(record_token):
+    """
+    Get the record type a record's tokens are meant to be, if any
+    """
+    if len(record_token) == 0:
+        return None
+    elif record_token[0].startswith("$"):
+        return record_token[0]
+
+    for tok in record_token[1:3]:
+        if tok in SUPPORTED_RECORDS:
+            return tok
+
+    return None
+
+
+INVALID_VALUE_PATTERN = re.compile(r"invalid \S+ value: '(.*)'$")
+
+
+def locate_error(error, record_token):
+    """
+    Find the index of the token in @record_token that caused
+    the InvalidLineException @error, or 0 if it is unknown.
+    """
+    bad_token = None
+    reason = getattr(error, 'reason', None) or ""
+
+    match = INVALID_VALUE_PATTERN.search(reason)
+    if match is not None:
+        bad_token = match.group(1)
+    elif getattr(error, 'unmatched', None):
+        bad_token = error.unmatched[0]
+
+    if bad_token is not None and bad_token == guess_record_type(record_token):
+        # the record type was taken for the TTL, which happens
+        # when the record has too many fields
+        return len(record_token) - 1
+
+    if bad_token is not None:
+        # search from the end, since unmatched tokens are trailing ones
+        for i in xrange(len(record_token) - 1, -1, -1):
+            if record_token[i] == bad_token:
+                return i
+
+    if "too few arguments" in reason:
+        return len(record_token) - 1
+
+    return 0
+
+
+def iter_raw_records(lines, ignore_invalid=False, limits=None, errors=None, filename=None,
+                     counts=None):
+    """
+    Parse an iterable of a zonefile's lines into a sequence of
+    (record type, record dict) pairs (see parse_record), without
+    applying any directives.  @limits and @counts are as in
+    iter_record_spans.
+
+    Invalid records (including one left unterminated at the end of the
+    input) raise an InvalidLineException with the line, column and
+    record type of the error; if @ignore_invalid is set, they are
+    skipped instead, and the exception is appended to @errors (if given).
+    """
+    parser = get_parser()
+    spans = iter_record_spans(lines, limits=limits, counts=counts)
+    while True:
+        try:
+            (record_token, token_lines, token_cols) = next(spans)
+        except StopIteration:
+            return
+        except ParseLimitException:
+            raise
+        except InvalidLineException, e:
+            # the input ended inside a record
+            if filename is not None:
+                e = InvalidLineException("%s: %s" % (filename, e), lineno=e.lineno, column=e.column,
+                                         record_type=e.record_type, line=e.line, filename=filename)
+
+            if ignore_invalid:
+                if errors is not None:
+                    errors.append(e)
+
+                return
+            else:
+                raise e
+
+        try:
+            yield parse_record(parser, record_token)
+        except InvalidLineException, e:
+            i = locate_error(e, record_token)
+            record_type = guess_record_type(record_token)
+            line = " ".join(record_token)
+
+            message = "line %d, column %d: invalid %s: %s" % (
+                token_lines[i], token_cols[i],
+                "%s record" % record_type if record_type is not None else "record", line)
+            if filename is not None:
+                message = "%s: %s" % (filename, message)
+
+            error = InvalidLineException(message, lineno=token_lines[i], column=token_cols[i],
+                                         record_type=record_type, line=line, filename=filename)
+            if ignore_invalid:
+                if errors is not None:
+                    errors.append(error)
+
+                continue
+            else:
+                raise error
+
+
+DEFAULT_INCLUDE_CACHE_SIZE = 256
+
+INCLUDE_CACHE_LOCKS = 64
+
+
+class IncludeCache(object):
+    """
+    Cache of the parsed contents of $INCLUDE files, so that a file is
+    parsed once no matter how many zones include it.  An entry is
+    re-parsed if the file's modification time or size changes.
+    Holds up to @max_entries files, dropping the least recently used.
+    Safe to share between threads.
+    """
+    def __init__(self, max_entries=DEFAULT_INCLUDE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._locks = [threading.Lock() for i in xrange(0, INCLUDE_CACHE_LOCKS)]
+        self._lock = threading.Lock()
+
+    def get(self, path, ignore_invalid=False, limits=None, errors=None, counts=None):
+        """
+        Get the raw records in the file at @path (see iter_raw_records).
+        Invalid records skipped in the file are appended to @errors.
+        The file's characters and records are added to @counts (see
+        ParseCounts), if given, whether or not it was cached.
+        Raise IOError or OSError if it cannot be read, and
+        ParseLimitException if it exceeds the @limits.
+        """
+        path = os.path.abspath(path)
+        key = (path, ignore_invalid, limits)
+
+        # files that share a lock are parsed one at a time
+        with self._locks[hash(key) % len(self._locks)]:
+            st = os.stat(path)
+            stamp = (st.st_mtime, st.st_size)
+
+            with self._lock:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._entries[key] = entry
+
+            if entry is None or entry[0] != stamp:
+                file_errors = []
+                file_counts = ParseCounts(limits)
+                with open(path, "r") as f:
+                    records = tuple(iter_raw_records(iter_file_lines(f, limits),
+                                                     ignore_invalid=ignore_invalid, limits=limits,
+                                                     errors=file_errors, filename=path,
+                                                     counts=file_counts))
+
+                entry = (stamp, records, tuple(file_errors),
+                         file_counts.num_bytes, file_counts.num_records)
+                with self._lock:
+                    self._entries.pop(key, None)
+                    self._entries[key] = entry
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+
+        if counts is not None:
+            counts.add(num_bytes=entry[3], num_records=entry[4], where=path)
+
+        if errors is not None:
+            errors.extend(entry[2])
+
+        return entry[1]
+
+    def clear(self):
+        """
+        Drop all cached files
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+default_include_cache = IncludeCache()
+
+MAX_INCLUDE_DEPTH = 16
+
+
+def include_path(name, include_dir, include_root):
+    """
+    Get the real path of the $INCLUDE'd file @name, read relative
+    to @include_dir.  Raise ValueError if it is not a regular file
+    under @include_root.
+    """
+    path = os.path.realpath(os.path.join(include_dir, name))
+    if path != include_root and not path.startswith(include_root.rstrip(os.sep) + os.sep):
+        raise ValueError("not under the include directory")
+
+    try:
+        st = os.stat(path)
+    except OSError, e:
+        raise ValueError(e.strerror or str(e))
+
+    if not stat.S_ISREG(st.st_mode):
+        raise ValueError("not a regular file")
+
+    return path
+
+
+def _apply_directives(raw_records, state, include_dir, include_cache, ignore_invalid, includes):
+    """
+    Apply $ORIGIN, $TTL and $INCLUDE directives to a sequence of raw
+    records, generating the records in the form of iter_zone_file().
+    @state holds the current 'origin', the 'counts' read so far (see
+    ParseCounts), and the parse 'limits', 'errors', 'symbols' and
+    'ptr_refs' settings.
+    """
+    symbols = state['symbols']
+
+    for (record_type, record_dict) in raw_records:
+        if record_type == '$INCLUDE':
+            for record in _include(record_dict, state, include_dir, include_cache,
+                                   ignore_invalid, includes):
+                yield record
+
+            continue
+
+        if record_type.startswith("$"):
+            value = record_dict[record_type]
+            if record_type == '$ORIGIN':
+                if symbols is not None:
+                    value = symbols.intern(value)
+
+                state['origin'] = value
+
+            yield {'type': record_type.lower(), 'value': value}
+            continue
+
+        record_dict = dict(record_dict)
+        if symbols is not None:
+            record_dict['name'] = symbols.intern(record_dict['name'])
+            for field in NAME_FIELDS.get(record_type.lower(), ()):
+                if field in record_dict:
+                    record_dict[field] = symbols.intern(record_dict[field])
+
+        if record_type == 'PTR' and state['origin'] is not None:
+            if state['ptr_refs']:
+                record_dict['fullname'] = NameRef(record_dict['name'], state['origin'])
+            else:
+                record_dict['fullname'] = ptr_fullname(record_dict['name'], state['origin'])
+
+        record_dict['type'] = record_type.lower()
+        yield record_dict
+
+
+def _include(record_dict, state, include_dir, include_cache, ignore_invalid, includes):
+    """
+    Generate the records of an $INCLUDE'd file.
+    The $ORIGIN reverts to its previous value at the end of the file.
+    """
+    line = " ".join(["$INCLUDE", record_dict['$INCLUDE']] +
+                    ([record_dict['origin']] if 'origin' in record_dict else []))
+
+    try:
+        if state['include_root'] is None:
+            raise InvalidLineException("%s: $INCLUDE is disabled" % line,
+                                       record_type='$INCLUDE', line=line)
+
+        try:
+            path = include_path(record_dict['$INCLUDE'], include_dir, state['include_root'])
+        except ValueError, e:
+            raise InvalidLineException("%s: %s" % (line, e), record_type='$INCLUDE', line=line)
+
+        if path in includes or len(includes) >= MAX_INCLUDE_DEPTH:
+            raise InvalidLineException("%s: $INCLUDE loop" % line, record_type='$INCLUDE', line=line)
+
+        try:
+            raw_records = include_cache.get(path, ignore_invalid=ignore_invalid, limits=state['limits'],
+                                            errors=state['errors'], counts=state['counts'])
+        except (IOError, OSError), e:
+            raise InvalidLineException("%s: %s" % (line, e), record_type='$INCLUDE', line=line)
+
+    # limits hold even if ignore_invalid is set
+    except ParseLimitException:
+        raise
+
+    except InvalidLineException, e:
+        if ignore_invalid:
+            if state['errors'] is not None:
+                state['errors'].append(e)
+
+            return
+        else:
+            raise
+
+    saved_origin = state['origin']
+    if 'origin' in record_dict:
+        state['origin'] = record_dict['origin']
+        if state['symbols'] is not None:
+            state['origin'] = state['symbols'].intern(state['origin'])
+
+        yield {'type': '$origin', 'value': state['origin']}
+
+    for record in _apply_directives(raw_records, state, os.path.dirname(path), include_cache,
+                                    ignore_invalid, includes + [path]):
+        yield record
+
+    if state['origin'] != saved_origin and saved_origin is not None:
+        state['origin'] = saved_origin
+        yield {'type': '$origin', 'value': saved_origin}
+
+
+def iter_zone_file(source, ignore_invalid=False, include_dir=None, include_cache=None,
+                   limits=None, errors=None, intern_names=True, symbols=None, ptr_refs=False):
+    """
+    Parse a zonefile, generating one dict per record as soon as it is read.
+    @source is either the zonefile text, an open file, or an
+    iterable of its lines.
+
+    Each dict has a 'type' field with the lower-case record type.
+    Resource records have the same fields as in parse_zone_file()'s lists:
+        {"type": "a", "name": "www", "ip": "10.0.1.5"}
+    $ORIGIN and $TTL directives have the directive's value:
+        {"type": "$origin", "value": "example.com"}
+
+    $INCLUDE is only allowed if @include_dir is given.  Included files
+    are read relative to @include_dir, or relative to the including file
+    for nested includes, and must be regular files under @include_dir.
+    Their records are generated in place of the directive.  Included
+    files are parsed through @include_cache (by default, a bounded
+    cache shared by the whole process).  Disallowed $INCLUDEs are
+    invalid records.
+
+    Invalid records raise an InvalidLineException with the line, column
+    and record type of the error.  If @ignore_invalid is set, they are
+    skipped instead, and the exceptions are appended to @errors (if given).
+
+    If @limits (see ParseLimits) are given, raise ParseLimitException
+    as soon as the input (with its $INCLUDE'd files) exceeds one, even
+    if @ignore_invalid is set.  Lines of an open file are read at most
+    max_record_length characters at a time.
+
+    If @intern_names is set, owner names, domain names in record data and
+    origins are interned in the SymbolTable @symbols (by default, a new
+    one per zone), so repeated names share one string.  If @ptr_refs is
+    set, PTR 'fullname's are NameRef (label, origin) pairs instead of
+    strings.
+    """
+    if isinstance(source, basestring):
+        if limits is not None and limits.max_bytes is not None and len(source) > limits.max_bytes:
+            raise ParseLimitException("zonefile exceeds %d bytes" % limits.max_bytes)
+
+        source = source.split("\n")
+    elif hasattr(source, 'readline'):
+        source = iter_file_lines(source, limits)
+
+    include_root = None
+    if include_dir is not None:
+        include_dir = include_root = os.path.realpath(include_dir)
+
+    if include_cache is None:
+        include_cache = default_include_cache
+
+    if intern_names and symbols is None:
+        symbols = SymbolTable()
+    elif not intern_names:
+        symbols = None
+
+    counts = ParseCounts(limits)
+    state = {'origin': None, 'limits': limits, 'errors': errors, 'symbols': symbols,
+             'ptr_refs': ptr_refs, 'include_root': include_root, 'counts': counts}
+    raw_records = iter_raw_records(source, ignore_invalid=ignore_invalid, limits=limits,
+                                   errors=errors, counts=counts)
+    return _apply_directives(raw_records, state, include_dir, include_cache, ignore_invalid, [])
+
+
+def parse_zone_file(text, ignore_invalid=False, include_dir=None, include_cache=None,
+                    limits=None, errors=None, intern_names=True, symbols=None, ptr_refs=False):
     """
-    Parse a zonefile into a dict
+    Parse a zonefile into a dict.
+
+    The dict's $origin and $ttl are the zone's first $ORIGIN and $TTL.
+    Records read under a different $ORIGIN get an 'origin' field, and
+    records without a TTL read under a different $TTL get a 'ttl' field.
+    See iter_zone_file() for $INCLUDE handling, @limits, @errors and
+    name interning.
     """
-    text = remove_comments(text)
-    text = flatten(text)
-    text = remove_class(text)
-    text = add_default_name(text)
-    json_zone_file = parse_lines(text, ignore_invalid=ignore_invalid)
+    json_zone_file = defaultdict(list)
+    origin = None
+    ttl = None
+
+    records = iter_zone_file(text, ignore_invalid=ignore_invalid, include_dir=include_dir,
+                             include_cache=include_cache, limits=limits, errors=errors,
+                             intern_names=intern_names, symbols=symbols, ptr_refs=ptr_refs)
+
+    for record in records:
+        record_type = record.pop('type')
+        if record_type == '$origin':
+            origin = record['value']
+            json_zone_file.setdefault(record_type, origin)
+
+        elif record_type == '$ttl':
+            ttl = record['value']
+            json_zone_file.setdefault(record_type, ttl)
+
+        else:
+            if origin is not None and origin != json_zone_file.get('$origin'):
+                record['origin'] = origin
+
+            if ttl is not None and 'ttl' not in record and ttl != json_zone_file.get('$ttl'):
+                record['ttl'] = ttl
+
+            json_zone_file[record_type].append(record)
+
     return json_zone_file
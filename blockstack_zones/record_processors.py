@@ -1,4 +1,8 @@
 import copy
+import operator
+import threading
+
+from .configs import NAME_FIELDS
 
 
 def process_origin(data, template):
@@ -23,46 +27,86 @@ def process_ttl(data, template):
     return template.replace("{$ttl}", record)
 
 
-def process_soa(data, template):
+def qualify_name(name, origin):
     """
-    Replace {SOA} in template with a set of serialized SOA records
+    Make a (possibly relative) name absolute, given its origin
     """
-    record = template[:]
+    name = str(name)
+    origin = origin.rstrip('.') + '.'
+    if name == '@':
+        return origin
+    elif name.endswith('.'):
+        return name
 
-    if data is not None:
-    
-        assert len(data) == 1, "Only support one SOA RR at this time"
-        data = data[0][0]
+    return name + '.' + origin
+
+
+def qualify_names(datum, record_type):
+    """
+    Given a record with an 'origin' field (i.e. read under a different
+    $ORIGIN than the zone's), make its name and the domain names in its
+    data absolute.  Return the new record.
+    """
+    origin = datum['origin']
+    datum = dict(datum)
+    datum['name'] = qualify_name(datum.get('name', '@'), origin)
+    for field in NAME_FIELDS.get(record_type.lower(), []):
+        if field in datum:
+            datum[field] = qualify_name(datum[field], origin)
+
+    return datum
+
+
+def serialize_soa(data):
+    """
+    Serialize a single SOA record
+    """
+    if data.get('origin') is not None:
+        data = qualify_names(data, 'soa')
+
+    soadat = []
+    domain_fields = ['mname', 'rname']
+    param_fields = ['serial', 'refresh', 'retry', 'expire', 'minimum']
 
-        soadat = []
-        domain_fields = ['mname', 'rname']
-        param_fields = ['serial', 'refresh', 'retry', 'expire', 'minimum']
+    for f in domain_fields + param_fields:
+        assert f in data.keys(), "Missing '%s' (%s)" % (f, data)
 
-        for f in domain_fields + param_fields:
-            assert f in data.keys(), "Missing '%s' (%s)" % (f, data)
+    data_name = str(data.get('name', '@'))
+    soadat.append(data_name)
 
-        data_name = str(data.get('name', '@'))
-        soadat.append(data_name)
+    if data.get('ttl') is not None:
+        soadat.append( str(data['ttl']) )
 
-        if data.get('ttl') is not None:
-            soadat.append( str(data['ttl']) )
-  
-        soadat.append("IN")
-        soadat.append("SOA")
+    soadat.append("IN")
+    soadat.append("SOA")
 
-        for key in domain_fields:
-            value = str(data[key])
-            soadat.append(value)
+    for key in domain_fields:
+        value = str(data[key])
+        soadat.append(value)
 
-        soadat.append("(")
+    soadat.append("(")
 
-        for key in param_fields:
-            value = str(data[key])
-            soadat.append(value)
+    for key in param_fields:
+        value = str(data[key])
+        soadat.append(value)
 
-        soadat.append(")")
+    soadat.append(")")
 
-        soa_txt = " ".join(soadat)
+    return " ".join(soadat)
+
+
+def process_soa(data, template):
+    """
+    Replace {SOA} in template with a set of serialized SOA records
+    """
+    record = template[:]
+
+    if data is not None:
+    
+        assert len(data) == 1, "Only support one SOA RR at this time"
+        data = data[0][0]
+
+        soa_txt = serialize_soa(data)
         record = record.replace("{soa}", soa_txt)
 
     else:
@@ -82,17 +126,118 @@ def quote_field(data, field):
 
     data_dup = copy.deepcopy(data)
     for i in xrange(0, len(data_dup)):
-        data_dup[i][field] = '"%s"' % data_dup[i][field]
-        data_dup[i][field] = data_dup[i][field].replace(";", "\;")
+        data_dup[i][field] = quote_value(data_dup[i][field])
 
     return data_dup
 
 
-def process_rr(data, record_type, record_keys, field, template):
+def quote_value(value):
+    """
+    Quote a field value, escaping semicolons
+    """
+    value = '"%s"' % value
+    return value.replace(";", "\;")
+
+
+def make_serializer(record_type, record_keys, quoted_key=None):
+    """
+    Build a function that serializes a single DNS record of type
+    @record_type, using the list of @record_keys from the datum
+    (and quoting the value of @quoted_key, if given).
+    Like str() on each field, the result is always a str: unicode
+    values must be ASCII, or UnicodeEncodeError is raised.
+    """
+    record_keys = tuple(record_keys)
+    fields = " ".join('"%s"' if key == quoted_key else "%s" for key in record_keys)
+    fmt_ttl = "%s %s " + record_type + " " + fields
+    fmt_no_ttl = "%s " + record_type + " " + fields
+
+    quoted_index = record_keys.index(quoted_key) if quoted_key in record_keys else None
+
+    if len(record_keys) == 1 and quoted_index is None:
+        # the common case: a single unquoted field
+        record_key = record_keys[0]
+
+        def serialize(datum):
+            if datum.get('origin') is not None:
+                datum = qualify_names(datum, record_type)
+
+            try:
+                value = datum[record_key]
+            except KeyError:
+                raise AssertionError("Missing '%s'" % record_key)
+
+            ttl = datum.get('ttl')
+            if ttl is None:
+                return str(fmt_no_ttl % (datum.get('name', '@'), value))
+
+            return str(fmt_ttl % (datum.get('name', '@'), ttl, value))
+
+        return serialize
+
+    if len(record_keys) == 1:
+        getter = operator.itemgetter(record_keys[0])
+        get_values = lambda datum: (getter(datum),)
+    else:
+        get_values = operator.itemgetter(*record_keys)
+
+    def serialize(datum):
+        if datum.get('origin') is not None:
+            datum = qualify_names(datum, record_type)
+
+        try:
+            values = get_values(datum)
+        except KeyError, e:
+            raise AssertionError("Missing '%s'" % e.args[0])
+
+        if quoted_index is not None:
+            values = list(values)
+            values[quoted_index] = ("%s" % values[quoted_index]).replace(";", "\\;")
+            values = tuple(values)
+
+        ttl = datum.get('ttl')
+        if ttl is None:
+            return str(fmt_no_ttl % ((datum.get('name', '@'),) + values))
+
+        return str(fmt_ttl % ((datum.get('name', '@'), ttl) + values))
+
+    return serialize
+
+
+_serializers = {}
+_serializers_lock = threading.Lock()
+
+
+def get_serializer(record_type, record_keys, quoted_key=None):
+    """
+    Get the serializer for records of @record_type (see make_serializer).
+    Each is built once, and shared.
+    """
+    key = (record_type, tuple(record_keys), quoted_key)
+    serializer = _serializers.get(key)
+    if serializer is None:
+        with _serializers_lock:
+            serializer = _serializers.get(key)
+            if serializer is None:
+                serializer = make_serializer(record_type, record_keys, quoted_key)
+                _serializers[key] = serializer
+
+    return serializer
+
+
+def serialize_rr(datum, record_type, record_keys, quoted_key=None):
+    """
+    Serialize a single DNS record of type @record_type,
+    using the list of @record_keys from the datum.
+    """
+    return get_serializer(record_type, record_keys, quoted_key)(datum)
+
+
+def process_rr(data, record_type, record_keys, field, template, quoted_key=None):
     """
     Meta method:
     Replace $field in template with the serialized $record_type records,
-    using @record_key from each datum.
+    using @record_key from each datum (and quoting @quoted_key).
     """
     if data is None:
         return template.replace(field, "")
@@ -106,20 +251,11 @@ def process_rr(data, record_type, record_keys, field, template):
 
     assert type(data) == list, "Data must be a list"
 
-    record = ""
-    for i in xrange(0, len(data)):
-
-        for record_key in record_keys:
-            assert record_key in data[i].keys(), "Missing '%s'" % record_key
-
-        record_data = []
-        record_data.append( str(data[i].get('name', '@')) )
-        if data[i].get('ttl') is not None:
-            record_data.append( str(data[i]['ttl']) )
+    if len(data) == 0:
+        return template.replace(field, "")
 
-        record_data.append(record_type)
-        record_data += [str(data[i][record_key]) for record_key in record_keys]
-        record += " ".join(record_data) + "\n"
+    serializer = get_serializer(record_type, record_keys, quoted_key)
+    record = "\n".join(map(serializer, data)) + "\n"
 
     return template.replace(field, record)
 
@@ -170,9 +306,7 @@ def process_txt(data, template):
     """
     Replace {txt} in template with the serialized TXT records
     """
-    # quote txt
-    data_dup = quote_field(data, "txt")
-    return process_rr(data_dup, "TXT", "txt", "{txt}", template)
+    return process_rr(data, "TXT", "txt", "{txt}", template, quoted_key="txt")
 
 
 def process_srv(data, template):
@@ -193,6 +327,39 @@ def process_uri(data, template):
     """
     Replace {uri} in templtae with the serialized URI records
     """
-    # quote target 
-    data_dup = quote_field(data, "target")
-    return process_rr(data_dup, "URI", ["priority", "weight", "target"], "{uri}", template)
+    return process_rr(data, "URI", ["priority", "weight", "target"], "{uri}", template,
+                      quoted_key="target")
+
+
+# record type: (record keys, key to quote)
+RECORD_KEYS = {
+    'ns': (["host"], None),
+    'a': (["ip"], None),
+    'aaaa': (["ip"], None),
+    'cname': (["alias"], None),
+    'mx': (["preference", "host"], None),
+    'ptr': (["host"], None),
+    'txt': (["txt"], "txt"),
+    'srv': (["priority", "weight", "port", "target"], None),
+    'spf': (["data"], None),
+    'uri': (["priority", "weight", "target"], "target"),
+}
+
+
+def serialize_record(record_type, datum):
+    """
+    Serialize a single record of (lower-case) @record_type,
+    including $origin and $ttl directives (whose datum is the value).
+    """
+    if record_type == '$origin':
+        return process_origin(datum, "{$origin}")
+    elif record_type == '$ttl':
+        return process_ttl(datum, "{$ttl}")
+    elif record_type == 'soa':
+        return serialize_soa(datum)
+
+    if record_type not in RECORD_KEYS:
+        raise ValueError("Unsupported record type '%s'" % record_type)
+
+    record_keys, quoted_key = RECORD_KEYS[record_type]
+    return serialize_rr(datum, record_type.upper(), record_keys, quoted_key)
@@ -0,0 +1,414 @@
+"""
+Generate reverse (PTR) zones for IPv4 and IPv6 address ranges.
+
+Address ranges are given as CIDR blocks, and are split into
+in-addr.arpa zones at octet boundaries, or into ip6.arpa zones at
+nibble boundaries.  Zones are generated as zonefile text, without
+building a record dict per address, so ranges of millions of
+addresses are generated in constant memory.
+
+Host names come either from a pattern, for every address in the
+range, e.g.
+    "host-{dashed}.example.com."
+where {ip} is the address and {dashed} is the address with its '.'
+or ':' replaced by '-'; or from a mapping of address to host name,
+for sparse ranges (e.g. a sample of an IPv6 /48).
+"""
+
+import bisect
+import socket
+import itertools
+import string
+import struct
+import binascii
+from StringIO import StringIO
+
+from .record_processors import serialize_record
+
+# address family: (address bits, bits per label, reverse domain)
+FAMILIES = {
+    socket.AF_INET: (32, 8, 'in-addr.arpa.'),
+    socket.AF_INET6: (128, 4, 'ip6.arpa.'),
+}
+
+OCTETS = [str(i) for i in xrange(0, 256)]
+
+# number of lowest labels that vary within a run of addresses
+RUN_LABELS = {
+    socket.AF_INET: 1,
+    socket.AF_INET6: 2,
+}
+
+PATTERN_FIELDS = ('ip', 'dashed')
+
+# stands for the varying end of an address in a run's line template
+MARK = "\0"
+
+_run_entries = {}
+
+
+def pack_address(text):
+    """
+    Get (address family, packed address) of an IPv4 or IPv6 address.
+    Packed addresses of one family sort in numeric order.
+    Raise ValueError if it is neither.
+    """
+    family = socket.AF_INET6 if ":" in text else socket.AF_INET
+    try:
+        return family, socket.inet_pton(family, text)
+    except socket.error:
+        raise ValueError("Invalid address '%s'" % text)
+
+
+def packed_value(family, packed):
+    """
+    Get the integer value of a packed address
+    """
+    if family == socket.AF_INET:
+        return struct.unpack("!I", packed)[0]
+
+    return long(binascii.hexlify(packed), 16)
+
+
+def value_packed(family, value):
+    """
+    Get the packed form of an address, given its integer value
+    """
+    if family == socket.AF_INET:
+        return struct.pack("!I", value)
+
+    return binascii.unhexlify("%032x" % value)
+
+
+def parse_address(text):
+    """
+    Get (address family, integer value) of an IPv4 or IPv6 address.
+    Raise ValueError if it is neither.
+    """
+    family, packed = pack_address(text)
+    return family, packed_value(family, packed)
+
+
+def format_address(family, value):
+    """
+    Get the text form of an address, given its integer value
+    """
+    return socket.inet_ntop(family, value_packed(family, value))
+
+
+def parse_cidr(cidr):
+    """
+    Get (address family, network address, prefix length) of a CIDR block
+    (a bare address is a block of one).
+    Raise ValueError if it is invalid, or has host bits set.
+    """
+    if "/" in cidr:
+        address, prefixlen = cidr.split("/", 1)
+    else:
+        address, prefixlen = cidr, None
+
+    family, network = parse_address(address)
+    bits = FAMILIES[family][0]
+
+    try:
+        prefixlen = bits if prefixlen is None else int(prefixlen)
+    except ValueError:
+        raise ValueError("Invalid prefix length in '%s'" % cidr)
+
+    if prefixlen < 0 or prefixlen > bits:
+        raise ValueError("Invalid prefix length in '%s'" % cidr)
+
+    if network & ((1 << (bits - prefixlen)) - 1):
+        raise ValueError("Host bits set in '%s'" % cidr)
+
+    return family, network, prefixlen
+
+
+def default_zone_prefix(family, prefixlen):
+    """
+    Zone prefix length for a block: its prefix length, rounded up to a
+    label boundary, but leaving at least one label inside the zone
+    """
+    bits, step = FAMILIES[family][0:2]
+    return min(-(-prefixlen // step) * step, bits - step)
+
+
+def reverse_labels(family, value, num_labels):
+    """
+    Get the reverse name of the lowest @num_labels labels of @value,
+    least significant label first
+    """
+    if family == socket.AF_INET6:
+        digits = "%0*x" % (num_labels, value & ((1 << (4 * num_labels)) - 1))
+        return ".".join(digits[::-1]) if num_labels > 0 else ""
+
+    return ".".join(OCTETS[int((value >> (8 * i)) & 0xff)] for i in xrange(0, num_labels))
+
+
+def reverse_zone_name(family, address, zone_prefix):
+    """
+    Get the (absolute) name of the reverse zone
+    of prefix length @zone_prefix that holds @address
+    """
+    bits, step, domain = FAMILIES[family]
+    labels = reverse_labels(family, address >> (bits - zone_prefix), zone_prefix // step)
+    if len(labels) == 0:
+        return domain
+
+    return labels + "." + domain
+
+
+def iter_zone_blocks(family, network, prefixlen, zone_prefix):
+    """
+    Generate (zone base address, first address, last address) for each
+    zone of prefix length @zone_prefix that overlaps the block
+    """
+    bits = FAMILIES[family][0]
+    last = network + (1 << (bits - prefixlen)) - 1
+    zone_size = 1 << (bits - zone_prefix)
+
+    zone_base = network - (network % zone_size)
+    while zone_base <= last:
+        yield zone_base, max(zone_base, network), min(zone_base + zone_size - 1, last)
+        zone_base += zone_size
+
+
+def pattern_fields(pattern):
+    """
+    Check that a host name pattern only uses the fields in PATTERN_FIELDS.
+    Raise ValueError if not.
+    """
+    for (literal, field, spec, conversion) in string.Formatter().parse(pattern):
+        if field is not None and field not in PATTERN_FIELDS:
+            raise ValueError("Unknown field '{%s}' in host name pattern" % field)
+
+
+def dashed(ip):
+    """
+    Get the {dashed} form of an address' text
+    """
+    return ip.replace(".", "-").replace(":", "-")
+
+
+def run_entries(family, run_labels):
+    """
+    Get the (reverse name, end of address text) of every offset in
+    a run of addresses that vary in their lowest @run_labels labels
+    """
+    key = (family, run_labels)
+    if key not in _run_entries:
+        run_size = 1 << (FAMILIES[family][1] * run_labels)
+        if family == socket.AF_INET:
+            ends = OCTETS[0:run_size]
+        else:
+            ends = ["%0*x" % (run_labels, i) for i in xrange(0, run_size)]
+
+        _run_entries[key] = [(reverse_labels(family, i, run_labels), ends[i])
+                             for i in xrange(0, run_size)]
+
+    return _run_entries[key]
+
+
+def run_ip_prefix(family, run_base, run_labels):
+    """
+    Get the text that the addresses of a run (addresses that vary in
+    their lowest @run_labels labels) start with, before the part that
+    varies.  None if their text forms do not share one, as in IPv6
+    runs where the last group may be compressed away.
+    """
+    text = format_address(family, run_base)
+    if family == socket.AF_INET:
+        return text[:text.rindex(".") + 1]
+
+    if ((run_base & 0xffff) >> (4 * run_labels)) == 0 or "." in text:
+        return None
+
+    return text[:-run_labels]
+
+
+def _iter_pattern_lines(family, zone_base, first, last, depth, pattern):
+    """
+    Generate the PTR lines of a zone for the addresses in [@first, @last],
+    with host names from @pattern, in chunks of one run (all addresses
+    that vary in their lowest RUN_LABELS labels) each
+    """
+    run_labels = min(RUN_LABELS[family], depth)
+    run_bits = FAMILIES[family][1] * run_labels
+    run_size = 1 << run_bits
+    entries = run_entries(family, run_labels)
+
+    run_base = first - (first % run_size)
+    while run_base <= last:
+        lo = max(first, run_base) - run_base
+        hi = min(last, run_base + run_size - 1) - run_base
+
+        suffix = ""
+        if depth > run_labels:
+            suffix = "." + reverse_labels(family, (run_base - zone_base) >> run_bits,
+                                          depth - run_labels)
+
+        ip_prefix = run_ip_prefix(family, run_base, run_labels)
+        if ip_prefix is not None:
+            host = pattern.format(ip=ip_prefix + MARK, dashed=dashed(ip_prefix) + MARK)
+            parts = (suffix + " PTR " + host + "\n").split(MARK)
+            yield "".join([label + end.join(parts) for (label, end) in entries[lo:hi + 1]])
+
+        else:
+            lines = []
+            for i in xrange(lo, hi + 1):
+                ip = format_address(family, run_base + i)
+                host = pattern.format(ip=ip, dashed=dashed(ip))
+                lines.append(entries[i][0] + suffix + " PTR " + host + "\n")
+
+            yield "".join(lines)
+
+        run_base += run_size
+
+
+def _iter_mapped_lines(family, entries, depth):
+    """
+    Generate the PTR lines of a zone for a sorted list of
+    (family, packed address, host name) entries, in one chunk
+    """
+    if family == socket.AF_INET:
+        zone_mask = (1 << (depth * FAMILIES[family][1])) - 1
+        yield "".join([reverse_labels(family, packed_value(family, packed) & zone_mask, depth) +
+                       " PTR " + host + "\n" for (f, packed, host) in entries])
+        return
+
+    # the hex digits of every address, reversed and dotted all at once:
+    # each address takes 64 characters, starting from its lowest nibble,
+    # and the last address comes first
+    dotted = ".".join(binascii.hexlify("".join([packed for (f, packed, host) in entries]))[::-1])
+    size = 2 * depth - 1
+    offsets = xrange(64 * (len(entries) - 1), -1, -64)
+    yield "".join([dotted[i:i + size] + " PTR " + host + "\n"
+                   for (i, (f, packed, host)) in itertools.izip(offsets, entries)])
+
+
+def zone_header(origin, ttl=None, soa=None, ns=None):
+    """
+    Get the $ORIGIN, $TTL, SOA and NS lines at the start of a reverse zone.
+    @soa is a dict of SOA fields as in parse_zone_file()'s output, and
+    @ns a list of name server host names.
+    """
+    lines = [serialize_record('$origin', origin)]
+    if ttl is not None:
+        lines.append(serialize_record('$ttl', ttl))
+
+    if soa is not None:
+        soa = dict(soa)
+        soa['name'] = '@'
+        lines.append(serialize_record('soa', soa))
+
+    for host in (ns or []):
+        lines.append(serialize_record('ns', {'name': '@', 'host': host}))
+
+    return "\n".join(lines) + "\n"
+
+
+def _sorted_entries(hostnames):
+    """
+    Get the (family, packed address, host name) entries of a mapping
+    (or sequence of pairs) of address to host name, sorted
+    """
+    if hasattr(hostnames, 'items'):
+        hostnames = hostnames.items()
+
+    entries = [pack_address(address) + (host,) for (address, host) in hostnames]
+    entries.sort()
+    return entries
+
+
+def iter_reverse_zones(cidrs, hostnames, zone_prefix=None, ttl=None, soa=None, ns=None):
+    """
+    Generate (origin, chunks) for each reverse zone of the CIDR blocks in
+    @cidrs, in order, where chunks generates the zone's zonefile text,
+    starting with its header (see zone_header()).
+
+    @hostnames is either a pattern (see the module docs), for a PTR record for every
+    address; or a mapping (or sequence of pairs) of address to host name,
+    for PTR records for those addresses only, in which case zones without
+    any of those addresses are skipped.
+
+    Blocks are split into zones of prefix length @zone_prefix (a multiple
+    of 8 for IPv4, of 4 for IPv6), by default the block's own prefix length
+    rounded up to one.  Blocks smaller than a zone get a zone holding just
+    their own addresses.
+    """
+    if isinstance(hostnames, basestring):
+        pattern_fields(hostnames)
+        entries = None
+    else:
+        entries = _sorted_entries(hostnames)
+        keys = [(family, packed) for (family, packed, host) in entries]
+
+    for cidr in cidrs:
+        family, network, prefixlen = parse_cidr(cidr)
+        bits, step = FAMILIES[family][0:2]
+
+        block_zone_prefix = zone_prefix
+        if block_zone_prefix is None:
+            block_zone_prefix = default_zone_prefix(family, prefixlen)
+
+        if block_zone_prefix % step != 0 or not 0 <= block_zone_prefix < bits:
+            raise ValueError("Invalid zone prefix length %s for '%s'" % (block_zone_prefix, cidr))
+
+        depth = (bits - block_zone_prefix) // step
+
+        if entries is None:
+            for (zone_base, first, last) in iter_zone_blocks(family, network, prefixlen,
+                                                             block_zone_prefix):
+                origin = reverse_zone_name(family, zone_base, block_zone_prefix)
+                yield origin, _iter_zone_chunks(zone_header(origin, ttl, soa, ns),
+                                                _iter_pattern_lines(family, zone_base, first,
+                                                                    last, depth, hostnames))
+
+            continue
+
+        last = network + (1 << (bits - prefixlen)) - 1
+        start = bisect.bisect_left(keys, (family, value_packed(family, network)))
+        end = bisect.bisect_right(keys, (family, value_packed(family, last)))
+        zone_size = 1 << (bits - block_zone_prefix)
+
+        while start < end:
+            first = packed_value(family, keys[start][1])
+            zone_base = first - (first % zone_size)
+            zone_end = bisect.bisect_right(keys, (family, value_packed(family, zone_base + zone_size - 1)),
+                                           start, end)
+
+            origin = reverse_zone_name(family, zone_base, block_zone_prefix)
+            yield origin, _iter_zone_chunks(zone_header(origin, ttl, soa, ns),
+                                            _iter_mapped_lines(family, entries[start:zone_end], depth))
+            start = zone_end
+
+
+def _iter_zone_chunks(header, chunks):
+    """
+    Generate a zone's header, then its PTR lines
+    """
+    yield header
+    for chunk in chunks:
+        yield chunk
+
+
+def make_reverse_zone_file(cidrs, hostnames, output=None, zone_prefix=None, ttl=None):
+    """
+    Write the PTR records of every reverse zone of the CIDR blocks in
+    @cidrs (see iter_reverse_zones()) into a single zonefile, under one
+    $ORIGIN per zone, e.g. to $INCLUDE in a parent zone.
+
+    If @output (a file-like object) is given, write the zonefile to it.
+    Otherwise, return the zonefile.
+    """
+    stream = output
+    if stream is None:
+        stream = StringIO()
+
+    for (origin, chunks) in iter_reverse_zones(cidrs, hostnames, zone_prefix=zone_prefix,
+                                               ttl=ttl):
+        for chunk in chunks:
+            stream.write(chunk)
+
+    if output is None:
+        return stream.getvalue()
@@ -0,0 +1,245 @@
+"""
+Split a large zone file into shards, and merge shards back together.
+
+Both directions stream records (see iter_zone_file), so neither
+holds the zone in memory.  Every shard gets a copy of the $ORIGIN and
+$TTL directives and of the apex SOA and NS records, so each one is a
+valid zone file on its own.
+
+Each record in a shard ends with a "; seq=N" comment giving its
+position in the source zone, so that merging the shards puts the
+records back in their source order.
+"""
+
+import re
+import heapq
+import zlib
+from StringIO import StringIO
+
+from .parse_zone_file import iter_zone_file
+from .make_zone_file import make_record_line
+from .names import absolute_name, record_owner, canonical_name_key
+
+SEQ_PATTERN = re.compile(r";\s*seq=(\d+)\s*$")
+
+
+def hash_owner(owner, record, num_shards):
+    """
+    Shard key: pick a shard by a (stable) hash of the owner name
+    """
+    return (zlib.crc32(owner) & 0xffffffff) % num_shards
+
+
+def subtree_key(subtrees, fallback=hash_owner):
+    """
+    Make a shard key that puts the names under subtrees[i] in shard i.
+    Names under none of them are placed with @fallback.
+    """
+    suffixes = [absolute_name(s, None) for s in subtrees]
+
+    def key(owner, record, num_shards):
+        for i in xrange(0, len(suffixes)):
+            if owner == suffixes[i] or owner.endswith('.' + suffixes[i]):
+                return i
+
+        return fallback(owner, record, num_shards)
+
+    return key
+
+
+class ApexTracker(object):
+    """
+    Follow the $ORIGIN through a stream of records,
+    and recognize the records at the zone apex.
+    """
+    def __init__(self):
+        self.origin = None
+        self.apex = None
+
+    def update(self, record):
+        """
+        Process a $ORIGIN directive or record.
+        Return the record's owner, or None for directives.
+        """
+        record_type = record['type']
+        if record_type == '$origin':
+            self.origin = record['value']
+            if self.apex is None:
+                self.apex = absolute_name('@', self.origin)
+
+            return None
+
+        if record_type.startswith("$"):
+            return None
+
+        owner = record_owner(record, self.origin)
+        if record_type == 'soa':
+            self.apex = owner
+
+        return owner
+
+    def is_apex(self, record, owner):
+        """
+        Is this a SOA record, or an NS record at the zone apex?
+        """
+        return record['type'] == 'soa' or (record['type'] == 'ns' and owner == self.apex)
+
+
+def shard_zone_file(source, num_shards, key=hash_owner, outputs=None, ignore_invalid=False):
+    """
+    Partition the records of a zonefile (text, or iterable of lines)
+    into @num_shards zonefiles in a single pass.
+    Each record goes to shard key(owner, record, num_shards), where
+    owner is its absolute lower-case owner name.  Directives and apex
+    records go to every shard.  Records keep their relative order, and
+    are numbered with their position in the source (see above).
+
+    If @outputs (a list of @num_shards file-like objects) is given,
+    write the shards to them and return the number of records in each.
+    Otherwise, return the list of shard zonefiles.
+    """
+    streams = outputs
+    if streams is None:
+        streams = [StringIO() for i in xrange(0, num_shards)]
+
+    assert len(streams) == num_shards, "Need one output per shard"
+
+    counts = [0] * num_shards
+    tracker = ApexTracker()
+    seq = 0
+
+    for record in iter_zone_file(source, ignore_invalid=ignore_invalid):
+        owner = tracker.update(record)
+        line = make_record_line(record)
+        if owner is not None:
+            line = "%s ; seq=%d\n" % (line[:-1], seq)
+            seq += 1
+
+        if owner is None or tracker.is_apex(record, owner):
+            for i in xrange(0, num_shards):
+                streams[i].write(line)
+                counts[i] += 1
+
+        else:
+            i = key(owner, record, num_shards)
+            streams[i].write(line)
+            counts[i] += 1
+
+    if outputs is not None:
+        return counts
+
+    return [s.getvalue() for s in streams]
+
+
+def owner_order(owner, record):
+    """
+    Merge key: DNSSEC canonical order of owner names
+    """
+    return canonical_name_key(owner)
+
+
+def _iter_seq_lines(source, current):
+    """
+    Generate the lines of a shard (text, or iterable of lines), setting
+    current['seq'] to the sequence number on each line as it is read
+    (None if it has none)
+    """
+    if isinstance(source, basestring):
+        source = source.split("\n")
+
+    for line in source:
+        match = SEQ_PATTERN.search(line)
+        current['seq'] = int(match.group(1)) if match is not None else None
+        yield line
+
+
+def _iter_shard(shard_index, source, key, ignore_invalid):
+    """
+    Generate the records of one shard as
+    (merge key, shard index, position, $ORIGIN, $TTL, is apex, record).
+    With no @key, the merge key is the record's sequence number, or
+    its owner_order() if it has none.
+    """
+    tracker = ApexTracker()
+    ttl = None
+    position = 0
+
+    # shards hold one record per line, so each record is generated
+    # right after its line is read
+    current = {'seq': None}
+    lines = _iter_seq_lines(source, current)
+
+    for record in iter_zone_file(lines, ignore_invalid=ignore_invalid):
+        owner = tracker.update(record)
+        if owner is None:
+            if record['type'] == '$ttl':
+                ttl = record['value']
+
+            continue
+
+        if key is not None:
+            merge_key = key(owner, record)
+        elif current['seq'] is not None:
+            merge_key = current['seq']
+        else:
+            merge_key = owner_order(owner, record)
+
+        yield (merge_key, shard_index, position, tracker.origin, ttl,
+               tracker.is_apex(record, owner), record)
+
+        position += 1
+
+
+def merge_zone_files(shards, output=None, key=None, ignore_invalid=False):
+    """
+    k-way merge of the zonefiles in @shards (each a text, or iterable of
+    lines) into one zonefile.
+
+    By default, the records of shards made by shard_zone_file() are put
+    back in their source order.  Otherwise, each shard must already be
+    in @key order (by default, owner_order()); key(owner, record) is
+    compared across shards, and ties keep shard order, then record
+    order.  Apex records copied into several shards are only written
+    once.  $ORIGIN and $TTL directives are written wherever the
+    records' change.
+
+    If @output (a file-like object) is given, write the zonefile to it
+    and return the number of records written.  Otherwise, return the
+    zonefile.
+    """
+    stream = output
+    if stream is None:
+        stream = StringIO()
+
+    streams = [_iter_shard(i, shards[i], key, ignore_invalid) for i in xrange(0, len(shards))]
+
+    current_origin = None
+    current_ttl = None
+    apex_seen = set()
+    count = 0
+
+    for (k, i, position, origin, ttl, is_apex, record) in heapq.merge(*streams):
+        line = make_record_line(record)
+
+        if is_apex:
+            apex_id = (origin, line)
+            if apex_id in apex_seen:
+                continue
+
+            apex_seen.add(apex_id)
+
+        if origin != current_origin and origin is not None:
+            stream.write(make_record_line({'type': '$origin', 'value': origin}))
+            current_origin = origin
+
+        if ttl != current_ttl and ttl is not None:
+            stream.write(make_record_line({'type': '$ttl', 'value': ttl}))
+            current_ttl = ttl
+
+        stream.write(line)
+        count += 1
+
+    if output is not None:
+        return count
+
+    return stream.getvalue()
@@ -0,0 +1,269 @@
+"""
+Immutable snapshots of a parsed zone, for sharing a zone between
+reader threads while another thread updates it.
+
+A ZoneSnapshot never changes once built.  Updating one returns a new
+snapshot that shares all of its records except for the bucket of
+names that changed, so a small update does not copy the whole zone.
+A ZoneStore holds the current snapshot: readers just take it (no
+locks), and writers swap in a new one atomically.
+"""
+
+import threading
+from collections import defaultdict
+
+from .names import absolute_name, record_owner
+
+MIN_BUCKETS = 16
+
+
+def freeze_record(record):
+    """
+    Get the immutable form of a parsed record dict
+    """
+    return tuple(sorted(record.items()))
+
+
+def thaw_record(frozen):
+    """
+    Get a (new) parsed record dict from its immutable form
+    """
+    return dict(frozen)
+
+
+def name_key(name, origin):
+    """
+    Get the lookup key for a record name relative to @origin:
+    its absolute, lower-case form
+    """
+    return absolute_name(name, origin)
+
+
+def num_buckets_for(count):
+    """
+    Pick the number of buckets for a zone with @count records: about
+    the square root of the count (as a power of two), so that an update
+    copies about as many bucket references as bucket entries.
+    """
+    num_buckets = MIN_BUCKETS
+    while num_buckets * num_buckets < count:
+        num_buckets *= 2
+
+    return num_buckets
+
+
+class ZoneSnapshot(object):
+    """
+    Immutable, read-only view of a zone.
+    Records are looked up by owner name (relative to the zone's
+    $ORIGIN, or absolute; case-insensitively) and lower-case record
+    type.  Records with their own 'origin' (see parse_zone_file) are
+    found under their absolute owner name.
+    """
+    __slots__ = ('origin', 'ttl', '_buckets', '_count')
+
+    def __init__(self, origin=None, ttl=None, buckets=None, count=0):
+        if buckets is None:
+            buckets = tuple({} for i in xrange(0, MIN_BUCKETS))
+
+        object.__setattr__(self, 'origin', origin)
+        object.__setattr__(self, 'ttl', ttl)
+        object.__setattr__(self, '_buckets', buckets)
+        object.__setattr__(self, '_count', count)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ZoneSnapshot is immutable")
+
+    @classmethod
+    def from_dict(cls, json_zone_file):
+        """
+        Build a snapshot from the output of parse_zone_file()
+        """
+        origin = json_zone_file.get('$origin')
+        count = sum(len(v) for (k, v) in json_zone_file.items() if not k.startswith("$"))
+        buckets = tuple({} for i in xrange(0, num_buckets_for(count)))
+
+        for (record_type, records) in json_zone_file.items():
+            if record_type.startswith("$"):
+                continue
+
+            for record in records:
+                key = (record_owner(record, origin), record_type)
+                bucket = buckets[hash(key[0]) % len(buckets)]
+                bucket[key] = bucket.get(key, ()) + (freeze_record(record),)
+
+        return cls(origin, json_zone_file.get('$ttl'), buckets, count)
+
+    def __len__(self):
+        return self._count
+
+    def _bucket(self, key):
+        return self._buckets[hash(key) % len(self._buckets)]
+
+    def get(self, name, record_type=None):
+        """
+        Get the records at @name (of @record_type, if given), as
+        a list of new record dicts
+        """
+        key = name_key(name, self.origin)
+        bucket = self._bucket(key)
+
+        if record_type is not None:
+            return [thaw_record(r) for r in bucket.get((key, record_type.lower()), ())]
+
+        ret = []
+        for ((n, t), records) in bucket.items():
+            if n == key:
+                ret += [thaw_record(r) for r in records]
+
+        return ret
+
+    def records(self, record_type=None):
+        """
+        Generate (record type, record dict) for each record
+        (of @record_type, if given)
+        """
+        if record_type is not None:
+            record_type = record_type.lower()
+
+        for bucket in self._buckets:
+            for ((n, t), records) in bucket.items():
+                if record_type is None or t == record_type:
+                    for r in records:
+                        yield t, thaw_record(r)
+
+    def to_dict(self):
+        """
+        Get the zone in the form of parse_zone_file()'s output.
+        Records with the same name and type keep their order.
+        """
+        json_zone_file = defaultdict(list)
+        if self.origin is not None:
+            json_zone_file['$origin'] = self.origin
+
+        if self.ttl is not None:
+            json_zone_file['$ttl'] = self.ttl
+
+        for (record_type, record) in self.records():
+            json_zone_file[record_type].append(record)
+
+        return json_zone_file
+
+    def _update(self, owner, record_type, update):
+        """
+        Get a new snapshot, where the records at @owner (an absolute
+        name, as from name_key()) of @record_type are replaced by
+        update(current records).
+        Only the bucket holding @owner is copied.
+        """
+        key = (owner, record_type.lower())
+        index = hash(key[0]) % len(self._buckets)
+
+        bucket = dict(self._buckets[index])
+        old_records = bucket.get(key, ())
+        new_records = update(old_records)
+
+        if len(new_records) > 0:
+            bucket[key] = new_records
+        else:
+            bucket.pop(key, None)
+
+        buckets = self._buckets[:index] + (bucket,) + self._buckets[index + 1:]
+        count = self._count - len(old_records) + len(new_records)
+        return ZoneSnapshot(self.origin, self.ttl, buckets, count)
+
+    def add(self, record_type, record):
+        """
+        Get a new snapshot with @record added
+        """
+        frozen = freeze_record(record)
+        return self._update(self._owner(record), record_type, lambda records: records + (frozen,))
+
+    def remove(self, record_type, record):
+        """
+        Get a new snapshot without @record.
+        Raise ValueError if it is not in this snapshot.
+        """
+        frozen = freeze_record(record)
+
+        def update(records):
+            if frozen not in records:
+                raise ValueError("No such %s record: %s" % (record_type, record))
+
+            i = records.index(frozen)
+            return records[:i] + records[i + 1:]
+
+        return self._update(self._owner(record), record_type, update)
+
+    def replace(self, name, record_type, records):
+        """
+        Get a new snapshot where the records at @name of
+        @record_type are @records.
+        Raise ValueError if any of @records is not at @name.
+        """
+        owner = name_key(name, self.origin)
+        for record in records:
+            if self._owner(record) != owner:
+                raise ValueError("Record %s is not at %s" % (record, name))
+
+        frozen = tuple(freeze_record(r) for r in records)
+        return self._update(owner, record_type, lambda old_records: frozen)
+
+    def _owner(self, record):
+        """
+        Get the lookup key for a record's owner name
+        """
+        return record_owner(record, self.origin)
+
+    def with_directives(self, origin=None, ttl=None):
+        """
+        Get a new snapshot with a new $ORIGIN and/or $TTL.
+        Records without their own 'origin' move to the new $ORIGIN.
+        """
+        if origin is not None and origin != self.origin:
+            json_zone_file = self.to_dict()
+            json_zone_file['$origin'] = origin
+            return ZoneSnapshot.from_dict(json_zone_file).with_directives(ttl=ttl)
+
+        return ZoneSnapshot(origin if origin is not None else self.origin,
+                            ttl if ttl is not None else self.ttl,
+                            self._buckets, self._count)
+
+
+class ZoneStore(object):
+    """
+    Holds the current snapshot of a zone.
+    Readers call snapshot() and use the result without locking;
+    writers call update(), which swaps in the new snapshot atomically.
+    """
+    def __init__(self, snapshot=None):
+        if snapshot is None:
+            snapshot = ZoneSnapshot()
+
+        self._snapshot = snapshot
+        self._write_lock = threading.Lock()
+
+    @classmethod
+    def from_dict(cls, json_zone_file):
+        """
+        Make a store holding the output of parse_zone_file()
+        """
+        return cls(ZoneSnapshot.from_dict(json_zone_file))
+
+    def snapshot(self):
+        """
+        Get the current snapshot
+        """
+        return self._snapshot
+
+    def update(self, func):
+        """
+        Replace the current snapshot with func(current snapshot).
+        Writers are serialized, so no update is lost.
+        Return the new snapshot.
+        """
+        with self._write_lock:
+            snapshot = func(self._snapshot)
+            self._snapshot = snapshot
+
+        return snapshot
@@ -1,8 +1,21 @@
+import os
+import re
 import json
+import socket
+import shutil
+import tempfile
+import threading
 import traceback
 import unittest
+from StringIO import StringIO
 from test import test_support
 from blockstack_zones import make_zone_file, parse_zone_file
+from blockstack_zones import iter_zone_file, iter_zone_file_lines
+from blockstack_zones import ParseLimits, ParseLimitException, InvalidLineException
+from blockstack_zones.parse_zone_file import IncludeCache, iter_file_lines
+from blockstack_zones.parse_zone_file import remove_comments, flatten, remove_class, add_default_name, parse_lines
+from blockstack_zones import batch, shard, canonical, reverse
+from blockstack_zones.zone_store import ZoneSnapshot, ZoneStore
 from test_sample_data import zone_files, zone_file_objects
 
 class ZoneFileTests(unittest.TestCase):
@@ -39,6 +52,21 @@ class ZoneFileTests(unittest.TestCase):
         self.assertTrue("$TTL" in zone_file)
         self.assertTrue("@ IN SOA" in zone_file)
 
+    def test_zone_file_creation_serializers(self):
+        zone_file = make_zone_file({
+            "txt": [{"name": "txt1", "ttl": 60, "txt": "v=DKIM1; k=rsa"}],
+            "srv": [{"name": "_sip._tcp", "priority": 10, "weight": 0, "port": 5060, "target": "sip"}]
+        })
+        self.assertEqual(zone_file, 'txt1 60 TXT "v=DKIM1\\; k=rsa"\n_sip._tcp SRV 10 0 5060 sip\n')
+        self.assertRaises(AssertionError, make_zone_file, {"a": [{"name": "www"}]})
+
+        # JSON input gives unicode values; the zone file is still a str
+        zone_file = make_zone_file(json.loads('{"a": [{"name": "www", "ip": "10.0.0.1"}], ' +
+                                              '"txt": [{"name": "t", "txt": "x;y"}]}'))
+        self.assertTrue(type(zone_file) is str)
+        self.assertRaises(UnicodeEncodeError, make_zone_file,
+                          {"txt": [{"name": "t", "txt": u"caf\xe9"}]})
+
     def test_zone_file_parsing_1(self):
         zone_file = parse_zone_file(zone_files["sample_1"])
         print json.dumps(zone_file, indent=2)
@@ -70,9 +98,613 @@ class ZoneFileTests(unittest.TestCase):
         self.assertTrue("$ttl" in zone_file)
         self.assertTrue("$origin" in zone_file)
 
+    def test_zone_file_parsing_threads(self):
+        expected = dict((k, parse_zone_file(v)) for (k, v) in zone_files.items())
+        errors = []
+
+        def parse_all():
+            try:
+                for i in xrange(0, 10):
+                    for (k, v) in zone_files.items():
+                        assert parse_zone_file(v) == expected[k]
+            except Exception:
+                errors.append(traceback.format_exc())
+
+        threads = [threading.Thread(target=parse_all) for i in xrange(0, 8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+
+    def test_zone_file_streaming(self):
+        with open("tests/zonefile_reverse.txt") as f:
+            records = list(iter_zone_file(f))
+
+        self.assertEqual(records[0], {"type": "$origin", "value": "0.168.192.IN-ADDR.ARPA."})
+        self.assertEqual(records[-1]['type'], "ptr")
+        self.assertEqual(records[-1]['fullname'], "10.4.168.192.in-addr.arpa.")
+
+        for sample in zone_files.values():
+            zone_file = "".join(iter_zone_file_lines(iter_zone_file(sample)))
+            self.assertEqual(parse_zone_file(zone_file), parse_zone_file(sample))
+
+    def test_parse_lines(self):
+        for sample in zone_files.values():
+            text = add_default_name(remove_class(flatten(remove_comments(sample))))
+            json_zone_file = parse_lines(text)
+            self.assertEqual(json_zone_file['a'], parse_zone_file(sample).get('a', []))
+
+    def test_zone_file_multiple_origins(self):
+        with open("tests/zonefile_reverse.txt") as f:
+            zone_file_text = f.read()
+
+        zone_file = parse_zone_file(zone_file_text)
+        self.assertEqual(zone_file['$origin'], "0.168.192.IN-ADDR.ARPA.")
+        self.assertTrue('origin' not in zone_file['ptr'][0])
+        self.assertEqual(zone_file['ptr'][2]['origin'], "30.168.192.in-addr.arpa.")
+        self.assertEqual(zone_file['ptr'][4]['fullname'], "30.168.192.in-addr.arpa.")
+
+        # nothing is lost on the way back
+        self.assertEqual(canonical.canonicalize_zone_file(make_zone_file(zone_file)),
+                         canonical.canonicalize_zone_file(zone_file_text))
+
+    def test_zone_file_interning(self):
+        with open("tests/zonefile_reverse.txt") as f:
+            zone_file_text = f.read()
+
+        zone_file = parse_zone_file(zone_file_text)
+        self.assertTrue(zone_file['ptr'][2]['host'] is zone_file['ptr'][5]['host'])
+        self.assertTrue(zone_file['ptr'][2]['origin'] is zone_file['ptr'][3]['origin'])
+        self.assertEqual(parse_zone_file(zone_file_text, intern_names=False), zone_file)
+
+        refs = parse_zone_file(zone_file_text, ptr_refs=True)
+        self.assertEqual([str(r['fullname']) for r in refs['ptr']],
+                         [r['fullname'] for r in zone_file['ptr']])
+        self.assertTrue(refs['ptr'][0]['fullname'].origin is refs['$origin'])
+
+    def test_zone_file_errors(self):
+        zone_file_text = "$ORIGIN example.com\n\nwww 1h A 10.0.0.1\n" + \
+            "@ IN SOA ns1. admin. (\n  1 2 3\n  4 5 6 )\nwww A 10.0.0.2\nfoo BAR baz\n"
+
+        try:
+            parse_zone_file(zone_file_text)
+            self.fail("Invalid line not detected")
+        except InvalidLineException, e:
+            self.assertEqual((e.lineno, e.column, e.record_type), (3, 5, "A"))
+
+        errors = []
+        zone_file = parse_zone_file(zone_file_text, ignore_invalid=True, errors=errors)
+        self.assertEqual(len(zone_file['a']), 1)
+        self.assertEqual([(e.lineno, e.column, e.record_type) for e in errors],
+                         [(3, 5, "A"), (6, 7, "SOA"), (8, 1, None)])
+        self.assertTrue(str(errors[1]).startswith("line 6, column 7: invalid SOA record"))
+
+        # a record left open at the end of the input
+        unterminated = "www A 10.0.0.1\n@ IN SOA ns1. admin. (\n  1 2 3\n"
+        try:
+            parse_zone_file(unterminated)
+            self.fail("Unterminated record not detected")
+        except InvalidLineException, e:
+            self.assertEqual((e.lineno, e.column, e.record_type), (2, 1, "SOA"))
+
+        errors = []
+        zone_file = parse_zone_file(unterminated, ignore_invalid=True, errors=errors)
+        self.assertEqual(len(zone_file['a']), 1)
+        self.assertEqual([e.lineno for e in errors], [2])
+
+        # records missing their data
+        for (text, record_type) in [("www 60 A", "A"), ("www 3600 MX 10", "MX"), ("www 60 CNAME", "CNAME"),
+                                    ("www A", "A")]:
+            try:
+                parse_zone_file("$ORIGIN example.com\n" + text + "\n")
+                self.fail("Invalid line not detected: %s" % text)
+            except InvalidLineException, e:
+                self.assertEqual((e.lineno, e.column, e.record_type),
+                                 (2, len(text) - len(text.split()[-1]) + 1, record_type), text)
+
+            errors = []
+            zone_file = parse_zone_file(text + "\nmail A 10.0.0.3\n", ignore_invalid=True, errors=errors)
+            self.assertEqual(zone_file['a'], [{"name": "mail", "ip": "10.0.0.3"}])
+            self.assertEqual([e.lineno for e in errors], [1])
+
+    def test_zone_file_limits(self):
+        limits = ParseLimits(max_record_length=100, max_tokens=20, max_records=5, max_bytes=1000)
+        parse_zone_file(zone_files["sample_2"], limits=ParseLimits(max_records=10))
+
+        unterminated_paren = "$ORIGIN example.com\n@ IN SOA ns1. admin. (\n" + "1 2 3 4\n" * 100
+        unterminated_quote = "$ORIGIN example.com\nwww TXT \"" + "x " * 100
+        for (text, lineno) in [(unterminated_paren, 2), (unterminated_quote, 2),
+                               (zone_files["sample_2"], 8), ("www A 10.0.0.1\n" * 10, 6)]:
+            try:
+                parse_zone_file(text, ignore_invalid=True, limits=limits)
+                self.fail("Limits not enforced")
+            except ParseLimitException, e:
+                self.assertEqual(e.lineno, lineno, str(e))
+
+        # oversized text is rejected before it is split into lines
+        try:
+            parse_zone_file("www A 10.0.0.1\n" * 100, limits=ParseLimits(max_bytes=300))
+            self.fail("Limits not enforced")
+        except ParseLimitException, e:
+            self.assertEqual(e.lineno, None)
+
+        try:
+            parse_zone_file(StringIO("www A 10.0.0.1\n" * 100), limits=ParseLimits(max_bytes=300))
+            self.fail("Limits not enforced")
+        except ParseLimitException, e:
+            self.assertEqual(e.lineno, 21)
+
+        # exactly
+        for text in ("www A 10.0.0.1\n" * 10, "www A 10.0.0.1\n" * 9 + "www A 10.0.0.1",
+                     "\n" * 150, "x" * 150):
+            for source in (text, StringIO(text)):
+                self.assertEqual(len(text) <= 150, self._within_limits(source, ParseLimits(max_bytes=150)))
+                self.assertTrue(self._within_limits(source, ParseLimits(max_bytes=len(text))))
+                self.assertFalse(self._within_limits(source, ParseLimits(max_bytes=len(text) - 1)))
+
+    def _within_limits(self, source, limits):
+        if not isinstance(source, basestring):
+            source.seek(0)
+
+        try:
+            parse_zone_file(source, ignore_invalid=True, limits=limits)
+            return True
+        except ParseLimitException:
+            return False
+
+    def test_zone_file_include(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tmpdir, "fragment.txt"), "w") as f:
+                f.write("www A 10.0.0.1\n$TTL 60\nftp CNAME www\n")
+
+            zone_file_text = "$ORIGIN example.com.\n$TTL 3600\n" + \
+                "$INCLUDE fragment.txt sub.example.com.\nmail A 10.0.0.2\n"
+
+            cache = IncludeCache()
+            zone_file = parse_zone_file(zone_file_text, include_dir=tmpdir, include_cache=cache)
+            self.assertEqual(zone_file['a'], [
+                {"name": "www", "ip": "10.0.0.1", "origin": "sub.example.com."},
+                {"name": "mail", "ip": "10.0.0.2", "ttl": 60}])
+            self.assertEqual(zone_file['cname'], [
+                {"name": "ftp", "alias": "www", "origin": "sub.example.com.", "ttl": 60}])
+
+            # parsed once, and shared
+            raw_records = cache.get(os.path.join(tmpdir, "fragment.txt"))
+            parse_zone_file(zone_file_text, include_dir=tmpdir, include_cache=cache)
+            self.assertTrue(cache.get(os.path.join(tmpdir, "fragment.txt")) is raw_records)
+
+            # bounded
+            small_cache = IncludeCache(max_entries=1)
+            shutil.copy(os.path.join(tmpdir, "fragment.txt"), os.path.join(tmpdir, "fragment2.txt"))
+            for name in ("fragment.txt", "fragment2.txt"):
+                small_cache.get(os.path.join(tmpdir, name))
+            self.assertEqual(len(small_cache), 1)
+
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_zone_file_include_limits(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tmpdir, "fragment.txt"), "w") as f:
+                f.write("".join("host%d A 10.0.0.%d\n" % (i, i) for i in xrange(0, 50)))
+
+            zone_file_text = "$ORIGIN example.com.\n" + "$INCLUDE fragment.txt\n" * 50
+            zone_file = parse_zone_file(zone_file_text, include_dir=tmpdir, include_cache=IncludeCache())
+            self.assertEqual(len(zone_file['a']), 2500)
+
+            # the included records count towards the zone's limits, cached or not
+            for ignore_invalid in (False, True, True):
+                try:
+                    parse_zone_file(zone_file_text, include_dir=tmpdir, ignore_invalid=ignore_invalid,
+                                    limits=ParseLimits(max_records=60))
+                    self.fail("Limits not enforced")
+                except ParseLimitException, e:
+                    self.assertTrue("exceeds 60 records" in str(e), str(e))
+
+            self.assertRaises(ParseLimitException, parse_zone_file, zone_file_text, include_dir=tmpdir,
+                              limits=ParseLimits(max_bytes=1000))
+
+            # an over-long line is not read whole
+            with open(os.path.join(tmpdir, "long.txt"), "w") as f:
+                f.write("www TXT " + "x" * 100000 + "\n")
+
+            limits = ParseLimits(max_record_length=100)
+            with open(os.path.join(tmpdir, "long.txt")) as f:
+                self.assertEqual(len(next(iter_file_lines(f, limits))), 102)
+
+            self.assertRaises(ParseLimitException, parse_zone_file, "$INCLUDE long.txt\n",
+                              include_dir=tmpdir, ignore_invalid=True, limits=limits)
+            with open(os.path.join(tmpdir, "long.txt")) as f:
+                self.assertRaises(ParseLimitException, parse_zone_file, f, limits=limits)
+                self.assertTrue(f.tell() < 1000)
+
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_zone_file_include_restricted(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tmpdir, "zones"))
+            os.mkdir(os.path.join(tmpdir, "zones", "sub"))
+            with open(os.path.join(tmpdir, "secret.txt"), "w") as f:
+                f.write("www A 10.0.0.1\n")
+
+            include_dir = os.path.join(tmpdir, "zones")
+            os.symlink(os.path.join(tmpdir, "secret.txt"), os.path.join(include_dir, "link.txt"))
+
+            # disabled without an include directory
+            self.assertRaises(InvalidLineException, parse_zone_file,
+                              "$INCLUDE %s\n" % os.path.join(tmpdir, "secret.txt"))
+
+            for name in (os.path.join(tmpdir, "secret.txt"), "../secret.txt", "sub/../../secret.txt",
+                         "link.txt", "sub", "/dev/zero", "missing.txt"):
+                errors = []
+                zone_file = parse_zone_file("$INCLUDE %s\n" % name, include_dir=include_dir,
+                                            ignore_invalid=True, errors=errors)
+                self.assertEqual(zone_file.get('a'), None, name)
+                self.assertEqual(len(errors), 1, name)
+                self.assertEqual(errors[0].record_type, '$INCLUDE')
+
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class BatchTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.indir = os.path.join(self.tmpdir, "in")
+        self.outdir = os.path.join(self.tmpdir, "out")
+        os.mkdir(self.indir)
+        os.mkdir(self.outdir)
+
+        self.zone_path = os.path.join(self.indir, "sample_1.txt")
+        with open(self.zone_path, "w") as f:
+            f.write(zone_files["sample_1"])
+
+        self.json_path = os.path.join(self.indir, "naval.json")
+        with open(self.json_path, "w") as f:
+            f.write(json.dumps(zone_file_objects["sample_1"]))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_batch_directory(self):
+        results = list(batch.run_batch([self.indir], output_dir=self.outdir, jobs=2))
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertTrue('error' not in result, result.get('error'))
+
+        with open(os.path.join(self.outdir, "sample_1.json")) as f:
+            self.assertEqual(json.loads(f.read()), parse_zone_file(zone_files["sample_1"]))
+
+        with open(os.path.join(self.outdir, "naval.txt")) as f:
+            self.assertEqual(f.read(), make_zone_file(zone_file_objects["sample_1"]))
+
+    def test_batch_same_names(self):
+        for subdir in ("a", "b"):
+            os.mkdir(os.path.join(self.indir, subdir))
+            shutil.copy(self.zone_path, os.path.join(self.indir, subdir, "zone.txt"))
+
+        results = list(batch.run_batch([self.indir], output_dir=self.outdir, jobs=2))
+        self.assertEqual(sorted(os.path.relpath(r['output'], self.outdir) for r in results),
+                         [os.path.join("a", "zone.json"), os.path.join("b", "zone.json"),
+                          "naval.txt", "sample_1.json"])
+
+        # the same names, given directly
+        paths = [os.path.join(self.indir, subdir, "zone.txt") for subdir in ("a", "b")]
+        results = list(batch.run_batch(paths, output_dir=self.outdir))
+        self.assertTrue('error' not in results[0])
+        self.assertTrue("would overwrite" in results[1]['error'])
+
+    def test_batch_same_stem(self):
+        # a zone kept as both JSON and text converts to the other's name
+        pair_dir = os.path.join(self.tmpdir, "pair")
+        os.mkdir(pair_dir)
+        shutil.copy(self.zone_path, os.path.join(pair_dir, "zone.txt"))
+        shutil.copy(self.json_path, os.path.join(pair_dir, "zone.json"))
+
+        results = list(batch.run_batch([pair_dir], output_dir=self.outdir))
+        self.assertEqual([r.get('error') for r in results], [None, None])
+        self.assertEqual(sorted(os.path.basename(r['output']) for r in results), ["zone.json", "zone.txt"])
+
+        # converting in place never overwrites an input
+        with open(os.path.join(pair_dir, "zone.txt")) as f:
+            zone_file_text = f.read()
+
+        results = list(batch.run_batch([pair_dir], output_dir=pair_dir))
+        self.assertTrue(all("would overwrite the input" in r['error'] for r in results))
+        with open(os.path.join(pair_dir, "zone.txt")) as f:
+            self.assertEqual(f.read(), zone_file_text)
+
+        os.remove(os.path.join(pair_dir, "zone.json"))
+        results = list(batch.run_batch([pair_dir], output_dir=pair_dir))
+        self.assertTrue('error' not in results[0])
+        results = list(batch.run_batch([pair_dir], output_dir=pair_dir))
+        self.assertTrue(all("would overwrite the input" in r['error'] for r in results))
+
+    def test_batch_stdin_list(self):
+        stdin = StringIO("%s\n\n%s\n" % (self.json_path, self.zone_path))
+        paths = list(batch.iter_input_paths(['-'], stdin=stdin))
+        self.assertEqual(paths, [self.json_path, self.zone_path])
+
+    def test_serve(self):
+        requests = "%s\n%s\n%s\n" % (
+            self.zone_path,
+            json.dumps({"path": self.json_path, "origin": "example.com"}),
+            os.path.join(self.tmpdir, "missing.txt"))
+
+        out = StringIO()
+        count = batch.serve(StringIO(requests), out)
+        self.assertEqual(count, 3)
+
+        results = [json.loads(l) for l in out.getvalue().strip().split("\n")]
+        self.assertEqual(results[0]['type'], 'json')
+        self.assertTrue("$ORIGIN example.com" in results[1]['data'])
+        self.assertTrue('error' in results[2])
+
+    def test_ndjson(self):
+        result = batch.convert_file(self.zone_path, output_dir=self.outdir, ndjson=True)
+        self.assertEqual(result['type'], 'ndjson')
+        with open(result['output']) as f:
+            records = [json.loads(l) for l in f]
+        self.assertEqual(records, list(iter_zone_file(zone_files["sample_1"])))
+
+        result = batch.convert_file(result['output'], ndjson=True)
+        self.assertEqual(result['type'], 'zonefile')
+        self.assertEqual(parse_zone_file(result['data']), parse_zone_file(zone_files["sample_1"]))
+
+        out = StringIO()
+        results = [batch.stream_ndjson_file(path, out) for path in
+                   (os.path.join(self.tmpdir, "missing.txt"), self.zone_path)]
+        self.assertTrue('error' in results[0])
+        self.assertEqual(results[1], {'path': self.zone_path, 'type': 'ndjson'})
+        self.assertEqual([json.loads(l) for l in out.getvalue().strip().split("\n")], records)
+
+
+class ShardTests(unittest.TestCase):
+    def setUp(self):
+        # a zone in canonical order
+        names = sorted(["host%d" % i for i in xrange(0, 100)])
+        self.zone_file = "$ORIGIN example.com.\n$TTL 3600\n" + \
+            "@ IN SOA ns1.example.com. admin.example.com. ( 1 3600 600 604800 86400 )\n" + \
+            "@ NS ns1.example.com.\n" + \
+            "".join("%s A 10.0.0.%d\n" % (name, i) for (i, name) in enumerate(names))
+
+    def test_shard(self):
+        shards = shard.shard_zone_file(self.zone_file, 4)
+        self.assertEqual(len(shards), 4)
+
+        total = 0
+        for shard_zone_file in shards:
+            zf = parse_zone_file(shard_zone_file)
+            self.assertEqual(len(zf['soa']), 1)
+            self.assertEqual(len(zf['ns']), 1)
+            self.assertEqual(zf['$origin'], "example.com.")
+            total += len(zf['a'])
+
+        self.assertEqual(total, 100)
+
+    def test_shard_subtree(self):
+        zone_file = "$ORIGIN example.com.\nwww.a A 10.0.0.1\nwww.b A 10.0.0.2\nb.example.com. A 10.0.0.3\n"
+        key = shard.subtree_key(["a.example.com", "b.example.com."])
+        shards = shard.shard_zone_file(zone_file, 2, key=key)
+        self.assertEqual([r['name'] for r in parse_zone_file(shards[0])['a']], ["www.a"])
+        self.assertEqual([r['name'] for r in parse_zone_file(shards[1])['a']], ["www.b", "b.example.com."])
+
+    def test_merge(self):
+        shards = shard.shard_zone_file(self.zone_file, 4)
+        merged = shard.merge_zone_files(shards)
+        self.assertEqual(parse_zone_file(merged), parse_zone_file(self.zone_file))
+
+        # shards without sequence numbers, in owner order
+        shards = [re.sub(r" ; seq=\d+", "", s) for s in shards]
+        merged = shard.merge_zone_files(shards, key=shard.owner_order)
+        self.assertEqual(parse_zone_file(merged), parse_zone_file(self.zone_file))
+
+    def test_merge_unsorted(self):
+        with open("tests/zonefile_forward.txt") as f:
+            zone_file_text = f.read()
+
+        shards = shard.shard_zone_file(zone_file_text, 3)
+        merged = shard.merge_zone_files(shards)
+        self.assertEqual([r['name'] for r in parse_zone_file(merged)['a']],
+                         ["@", "@", "www", "mail", "@", "tst"])
+        self.assertEqual(parse_zone_file(merged), parse_zone_file(zone_file_text))
+
+
+class CanonicalTests(unittest.TestCase):
+    def test_canonical_equivalent(self):
+        zone_1 = "$ORIGIN example.com.\n$TTL 3600\nwww A 10.0.0.2\nWWW 3600 A 10.0.0.1\n@ MX 10 mail\n"
+        zone_2 = "$TTL 3600\n$ORIGIN example.com.\n@ MX 10 mail.example.com.\n" + \
+                 "$ORIGIN com.\nwww.example 3600 A 10.0.0.1\nwww.example.com. A 10.0.0.2\nwww.example A 10.0.0.2\n"
+
+        canonical_1 = canonical.canonicalize_zone_file(zone_1)
+        self.assertEqual(canonical_1, canonical.canonicalize_zone_file(zone_2))
+        self.assertEqual(canonical_1,
+            "$ORIGIN example.com.\n$TTL 3600\n@ MX 10 mail.example.com.\nwww A 10.0.0.1\nwww A 10.0.0.2\n")
+
+    def test_canonical_rrset_ttl(self):
+        zone_file = "$ORIGIN example.com.\n$TTL 3600\nwww A 10.0.0.1\nwww 300 A 10.0.0.1\n" + \
+            "www 3600 A 10.0.0.2\nmail 60 A 10.0.0.3\n"
+        self.assertEqual(canonical.canonicalize_zone_file(zone_file),
+            "$ORIGIN example.com.\n$TTL 3600\nmail 60 A 10.0.0.3\nwww 300 A 10.0.0.1\nwww 300 A 10.0.0.2\n")
+
+    def test_canonical_no_origin(self):
+        zone_file = "@ MX 10 mail\nwww.example.com. A 10.0.0.1\n"
+        self.assertEqual(canonical.canonicalize_zone_file(zone_file),
+                         "@ MX 10 mail\nwww.example.com. A 10.0.0.1\n")
+        self.assertRaises(ValueError, canonical.canonicalize_zone_file,
+                          "www A 10.0.0.1\n$ORIGIN example.com.\n")
+
+    def test_canonical_external_sort(self):
+        with open("tests/zonefile_forward.txt") as f:
+            zone_file = f.read()
+
+        in_memory = canonical.canonicalize_zone_file(zone_file + zone_file)
+        on_disk = canonical.canonicalize_zone_file(zone_file + zone_file, memory_budget=1024)
+        self.assertEqual(in_memory, on_disk)
+        self.assertEqual(canonical.canonicalize_zone_file(in_memory), in_memory)
+
+
+class ZoneStoreTests(unittest.TestCase):
+    def setUp(self):
+        with open("tests/zonefile_forward.txt") as f:
+            self.zone_file = parse_zone_file(f.read())
+
+    def test_snapshot(self):
+        snapshot = ZoneSnapshot.from_dict(self.zone_file)
+        self.assertEqual(len(snapshot), 17)
+        self.assertEqual(snapshot.origin, "MYDOMAIN.COM.")
+        self.assertEqual(snapshot.get("MAIL", "a"), [{"name": "mail", "ip": "127.0.0.1"}])
+        self.assertEqual(len(snapshot.get("mail")), 2)
+        self.assertRaises(AttributeError, setattr, snapshot, "origin", "example.com.")
+
+        zone_file = snapshot.to_dict()
+        for record_type in self.zone_file.keys():
+            if not record_type.startswith("$"):
+                self.assertEqual(sorted(zone_file[record_type]), sorted(self.zone_file[record_type]))
+
+    def test_snapshot_update(self):
+        snapshot = ZoneSnapshot.from_dict(self.zone_file)
+        updated = snapshot.add("a", {"name": "mail", "ip": "10.0.0.1"})
+        updated = updated.remove("a", {"name": "www", "ip": "127.0.0.1"})
+
+        # the old snapshot is unchanged
+        self.assertEqual(len(snapshot.get("mail", "a")), 1)
+        self.assertEqual(len(snapshot.get("www", "a")), 1)
+        self.assertEqual(len(updated.get("mail", "a")), 2)
+        self.assertEqual(updated.get("www", "a"), [])
+        self.assertEqual(len(updated), len(snapshot))
+        self.assertRaises(ValueError, updated.remove, "a", {"name": "www", "ip": "127.0.0.1"})
+
+        # untouched buckets are shared
+        shared = [b1 is b2 for (b1, b2) in zip(snapshot._buckets, updated._buckets)]
+        self.assertEqual(shared.count(False), 2 if len(set(
+            hash(n) % len(shared) for n in ("mail.mydomain.com", "www.mydomain.com"))) == 2 else 1)
+
+    def test_store(self):
+        store = ZoneStore.from_dict(self.zone_file)
+        before = store.snapshot()
+        after = store.update(lambda s: s.replace("www", "a", [{"name": "www", "ip": "10.0.0.2"}]))
+        self.assertTrue(store.snapshot() is after)
+        self.assertEqual(before.get("www", "a"), [{"name": "www", "ip": "127.0.0.1"}])
+        self.assertEqual(after.get("www", "a"), [{"name": "www", "ip": "10.0.0.2"}])
+        self.assertRaises(ValueError, after.replace, "www", "a", [{"name": "mail", "ip": "10.0.0.2"}])
+
+    def test_snapshot_origins(self):
+        zone_file_text = "$ORIGIN 0.168.192.in-addr.arpa.\n1 PTR host1.example.com.\n" \
+                         "$ORIGIN 30.168.192.in-addr.arpa.\n1 PTR host2.example.com.\n"
+        snapshot = ZoneSnapshot.from_dict(parse_zone_file(zone_file_text))
+        self.assertEqual([r['host'] for r in snapshot.get("1", "ptr")], ["host1.example.com."])
+        self.assertEqual([r['host'] for r in snapshot.get("1.30.168.192.IN-ADDR.ARPA.", "ptr")],
+                         ["host2.example.com."])
+
+        # a record under the other $ORIGIN is only reached by its own owner name
+        other = snapshot.get("1.30.168.192.in-addr.arpa.", "ptr")[0]
+        updated = snapshot.remove("ptr", other)
+        self.assertEqual(len(updated.get("1", "ptr")), 1)
+        self.assertEqual(updated.get("1.30.168.192.in-addr.arpa.", "ptr"), [])
+        self.assertRaises(ValueError, snapshot.replace, "1", "ptr", [other])
+
+        replaced = snapshot.replace("1.30.168.192.in-addr.arpa.", "ptr", [dict(other, host="host3.example.com.")])
+        self.assertEqual([r['host'] for r in replaced.get("1", "ptr")], ["host1.example.com."])
+        self.assertEqual(len(replaced), 2)
+
+        # moving to a new $ORIGIN moves only the records without their own
+        moved = snapshot.with_directives(origin="1.168.192.in-addr.arpa.")
+        self.assertEqual(moved.get("1.0.168.192.in-addr.arpa.", "ptr"), [])
+        self.assertEqual([r['host'] for r in moved.get("1", "ptr")], ["host1.example.com."])
+        self.assertEqual(len(moved.get("1.30.168.192.in-addr.arpa.", "ptr")), 1)
+
+
+class ReverseTests(unittest.TestCase):
+    def check_zone(self, zone_file_text, family):
+        """
+        Check that every PTR's host name holds its own address,
+        and return the PTR records
+        """
+        records = parse_zone_file(zone_file_text)['ptr']
+        for record in records:
+            labels = record['fullname'].split('.')[:-3][::-1]
+            if family == socket.AF_INET:
+                address = ".".join(labels)
+            else:
+                address = socket.inet_ntop(family, "".join(labels).decode("hex"))
+
+            self.assertEqual(record['host'], "h.%s." % address)
+
+        return records
+
+    def test_reverse_ipv4(self):
+        zones = [(origin, "".join(chunks)) for (origin, chunks) in
+                 reverse.iter_reverse_zones(["192.0.2.0/23", "198.51.100.64/26"], "h.{ip}.")] + \
+            [(origin, "".join(chunks)) for (origin, chunks) in
+             reverse.iter_reverse_zones(["10.1.4.0/22"], "h.{ip}.", zone_prefix=16)]
+        self.assertEqual([origin for (origin, text) in zones], [
+            "2.0.192.in-addr.arpa.", "3.0.192.in-addr.arpa.", "100.51.198.in-addr.arpa.",
+            "1.10.in-addr.arpa."])
+
+        counts = [len(self.check_zone(text, socket.AF_INET)) for (origin, text) in zones]
+        self.assertEqual(counts, [256, 256, 64, 1024])
+        self.assertTrue(zones[2][1].endswith("127 PTR h.198.51.100.127.\n"))
+        self.assertTrue(zones[3][1].startswith("$ORIGIN 1.10.in-addr.arpa.\n0.4 PTR h.10.1.4.0.\n"))
+
+        # same lines as make_zone_file()
+        records = [{"name": str(i), "host": "host-192-0-2-%d.example.com." % i} for i in xrange(0, 256)]
+        self.assertEqual(reverse.make_reverse_zone_file(["192.0.2.0/24"], "host-{dashed}.example.com."),
+                         make_zone_file({"$origin": "2.0.192.in-addr.arpa.", "ptr": records}))
+
+    def test_reverse_ipv6(self):
+        # the first run has compressed addresses
+        zone_file_text = reverse.make_reverse_zone_file(["2001:db8::/120", "2001:db8::1:0/116"],
+                                                        "h.{ip}.", zone_prefix=104)
+        records = self.check_zone(zone_file_text, socket.AF_INET6)
+        self.assertEqual(len(records), 256 + 4096)
+        self.assertEqual(records[0], {"name": "0.0.0.0.0.0", "host": "h.2001:db8::.",
+                                      "fullname": "0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0."
+                                      "8.b.d.0.1.0.0.2.ip6.arpa."})
+        self.assertTrue(zone_file_text.startswith(
+            "$ORIGIN 0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.8.b.d.0.1.0.0.2.ip6.arpa.\n"))
+
+    def test_reverse_mapping(self):
+        soa = {"mname": "ns1.example.com.", "rname": "admin.example.com.", "serial": 1,
+               "refresh": 3600, "retry": 600, "expire": 604800, "minimum": 86400}
+        hostnames = {"2001:db8:0:1::5": "h.2001:db8:0:1::5.", "2001:db8::1": "h.2001:db8::1.",
+                     "10.2.3.4": "h.10.2.3.4.", "192.0.2.1": "h.192.0.2.1."}
+
+        zones = [(origin, "".join(chunks)) for (origin, chunks) in
+                 reverse.iter_reverse_zones(["2001:db8::/48", "10.0.0.0/8"], hostnames,
+                                            ttl=3600, soa=soa, ns=["ns1.example.com."])]
+        self.assertEqual([origin for (origin, text) in zones],
+                         ["0.0.0.0.8.b.d.0.1.0.0.2.ip6.arpa.", "10.in-addr.arpa."])
+
+        zone_file = parse_zone_file(zones[0][1])
+        self.assertEqual(zone_file['soa'][0]['serial'], 1)
+        self.assertEqual(zone_file['ns'], [{"name": "@", "host": "ns1.example.com."}])
+        self.assertEqual(len(self.check_zone(zones[0][1], socket.AF_INET6)), 2)
+        self.assertEqual(len(self.check_zone(zones[1][1], socket.AF_INET)), 1)
+
+    def test_reverse_invalid(self):
+        for (cidrs, hostnames) in [(["192.0.2.1/24"], "h."), (["192.0.2.0/33"], "h."),
+                                   (["2001:db8::/48"], "h.{host}."), (["example.com"], "h.")]:
+            self.assertRaises(ValueError, list, reverse.iter_reverse_zones(cidrs, hostnames))
+
+        self.assertRaises(ValueError, list, reverse.iter_reverse_zones(["10.0.0.0/8"], "h.",
+                                                                       zone_prefix=12))
+
+
 def test_main():
     test_support.run_unittest(
-        ZoneFileTests
+        ZoneFileTests,
+        BatchTests,
+        ShardTests,
+        CanonicalTests,
+        ZoneStoreTests,
+        ReverseTests
     )
 
 